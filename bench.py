@@ -0,0 +1,475 @@
+import concurrent.futures
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import engpy
+
+LOOP_PROGRAM = '''x EQUALS 0
+y EQUALS 0
+FOR i FROM 0 TO 300 [
+	FOR j FROM 0 TO 300 [
+		x EQUALS x ADD i MULTIPLY 2 MINUS j
+		y EQUALS y ADD (LENGTH "abc")
+	]
+	IF i SAMEAS 150 [
+		OUTPUT x
+	]
+]
+OUTPUT x
+OUTPUT y'''
+
+def timeRun(text, **kwargs):
+	engpy.VARS_SAVED.clear()
+	with contextlib.redirect_stdout(io.StringIO()):
+		start = time.perf_counter()
+		result, error = engpy.run('<bench>', text, **kwargs)
+		elapsed = time.perf_counter() - start
+	if error:
+		print(error.asString(noArrows=True) if isinstance(error, engpy.Error) else error)
+	return elapsed
+
+def benchEngines():
+	print('Loop-heavy program (90,000 inner iterations)')
+	timings = {'tree': timeRun(LOOP_PROGRAM, engine='tree', tiering=False)}
+	timings['tiered'] = timeRun(LOOP_PROGRAM, engine='tree')
+	for engine in engpy.ENGINES:
+		if engine != 'tree':
+			timings[engine] = timeRun(LOOP_PROGRAM, engine=engine)
+
+	for engine, elapsed in timings.items():
+		print(f'{engine:>8}: {elapsed:.3f}s  ({timings["tree"] / elapsed:.1f}x)')
+
+def benchRepeatedRuns():
+	print('Short program run 2,000 times')
+	text = 'x EQUALS 5\ny EQUALS x MULTIPLY 2 ADD 1\nOUTPUT (LENGTH "hello") ADD y'
+	timings = {}
+	for engine in engpy.ENGINES:
+		timings[engine] = sum(timeRun(text, engine=engine) for i in range(2000))
+
+	for engine, elapsed in timings.items():
+		print(f'{engine:>8}: {elapsed:.3f}s  ({timings["tree"] / elapsed:.1f}x)')
+
+def benchOptimizer():
+	print('Constant-heavy loop at each optimization level')
+	text = '''x EQUALS 0
+FOR i FROM 0 TO 20000 [
+	x EQUALS x ADD (LENGTH "abcdef") MULTIPLY 2 MINUS 5 DIVIDE 5
+	IF 1 SAMEAS 1 [
+		y EQUALS "ab" JOIN "cd"
+	]
+]
+OUTPUT x'''
+	timings = {}
+	for opt_level in [0, 1, 2]:
+		timings[opt_level] = timeRun(text, engine='tree', tiering=False, opt_level=opt_level)
+
+	for opt_level, elapsed in timings.items():
+		print(f'{"-O" + str(opt_level):>8}: {elapsed:.3f}s  ({timings[0] / elapsed:.1f}x)')
+
+def benchInvariants():
+	print('Nested loops with loop invariant work (40,000 inner iterations)')
+	text = '''z EQUALS "abcdef"
+y EQUALS 3
+total EQUALS 0
+FOR i FROM 0 TO 200 [
+	FOR j FROM 0 TO 200 [
+		total EQUALS total ADD (LENGTH z) MULTIPLY y ADD (LENGTH z JOIN "gh") MINUS i
+	]
+]
+OUTPUT total'''
+	timings = {}
+	for engine in ['tree', 'closure']:
+		for opt_level in [0, 1]:
+			timings[f'{engine} -O{opt_level}'] = timeRun(text, engine=engine, tiering=False, opt_level=opt_level)
+
+	for name, elapsed in timings.items():
+		print(f'{name:>12}: {elapsed:.3f}s  ({timings["tree -O0"] / elapsed:.1f}x)')
+
+def benchSwitch():
+	print('ELSEIF chain with 300 arms, 3,000 lookups')
+	arms = '\n'.join(f'] ELSEIF x SAMEAS {n} [\n\t\ttotal EQUALS total ADD {n}' for n in range(1, 300))
+	text = f'''total EQUALS 0
+FOR i FROM 0 TO 3000 [
+	x EQUALS i DIVIDE 10
+	IF x SAMEAS 0 [
+		total EQUALS total ADD 1
+	{arms}
+	] ELSE [
+		total EQUALS total MINUS 1
+	]
+]
+OUTPUT total'''
+	timings = {}
+	for engine in ['tree', 'closure']:
+		for opt_level in [0, 1]:
+			timings[f'{engine} -O{opt_level}'] = timeRun(text, engine=engine, tiering=False, opt_level=opt_level)
+
+	for name, elapsed in timings.items():
+		print(f'{name:>12}: {elapsed:.3f}s  ({timings["tree -O0"] / elapsed:.1f}x)')
+
+def benchLexer():
+	line = 'x EQUALS x ADD 12 MULTIPLY (LENGTH "hello world") MINUS y\nOUTPUT "some text here" JOIN name\n'
+	text = line * 40000
+	print(f'Lexing a {len(text) / 1e6:.1f}MB script')
+	start = time.perf_counter()
+	stream, error = engpy.Lexer('<bench>', text).makeTokenStream()
+	elapsed = time.perf_counter() - start
+	print(f'{"lexer":>8}: {elapsed:.3f}s  ({len(text) / elapsed / 1e6:.1f}MB/s)')
+
+	depth = 40
+	block = ''.join('\t' * level + f'IF x SAMEAS {level} [\n' for level in range(depth))
+	block += '\t' * depth + 'OUTPUT x\n' + ''.join('\t' * level + ']\n' for level in reversed(range(depth)))
+	text = block * 500
+	print(f'Lexing a {len(text) / 1e6:.1f}MB script with blocks nested {depth} deep')
+	start = time.perf_counter()
+	stream, error = engpy.Lexer('<bench>', text).makeTokenStream()
+	elapsed = time.perf_counter() - start
+	print(f'{"lexer":>8}: {elapsed:.3f}s  ({len(text) / elapsed / 1e6:.1f}MB/s)')
+
+def benchParser():
+	line = 'x EQUALS ' + ' ADD '.join(f'({n} MULTIPLY (y MINUS {n}))' for n in range(400)) + '\n'
+	stream, error = engpy.Lexer('<bench>', line * 20).makeTokenStream()
+	print('Parsing 20 lines of 400 bracketed terms each')
+	start = time.perf_counter()
+	program, error, remaining_tokens = engpy.Parser(stream).parseProgram()
+	elapsed = time.perf_counter() - start
+	print(f'{"parser":>8}: {elapsed:.3f}s  ({len(program) / elapsed:.1f} lines/s)')
+
+def benchCache():
+	text = '\n'.join(f'x EQUALS {n} MULTIPLY (LENGTH "abc") ADD {n}\nIF x SAMEAS 3 [\n\tOUTPUT x ADD 1\n]' for n in range(1000))
+	print('4,000 line script with and without the on-disk program cache')
+	with tempfile.TemporaryDirectory() as directory:
+		cache = engpy.ProgramCache(directory)
+		timings = {'no cache': timeRun(text)}
+		timings['cold'] = timeRun(text, cache=cache)
+		timings['warm'] = timeRun(text, cache=cache)
+
+	for name, elapsed in timings.items():
+		print(f'{name:>8}: {elapsed:.3f}s  ({timings["no cache"] / elapsed:.1f}x)')
+
+def benchParseCache():
+	print('3 recurring snippets run 3,000 times on the tree engine')
+	snippets = ['x EQUALS 5 MULTIPLY (LENGTH "hello") ADD 2', 'y EQUALS "ab" JOIN "cd" MULTIPLY 3', 'IF 1 SAMEAS 2 [\n\tOUTPUT 1\n] ELSE [\n\tz EQUALS 4 ADD 4\n]']
+	timings = {}
+	for name, capacity in [('no cache', 0), ('cache', engpy.PARSE_CACHE_SIZE)]:
+		engpy.PARSE_CACHE.clear()
+		engpy.PARSE_CACHE.capacity = capacity
+		timings[name] = sum(timeRun(snippets[n % 3]) for n in range(3000))
+	engpy.PARSE_CACHE.capacity = engpy.PARSE_CACHE_SIZE
+
+	for name, elapsed in timings.items():
+		print(f'{name:>8}: {elapsed:.3f}s  ({timings["no cache"] / elapsed:.1f}x)')
+	print(f'{"":>8}  {engpy.PARSE_CACHE}')
+
+def countTokens(lines):
+	count = 0
+	for line in lines:
+		for token in line:
+			count += countTokens(token) if isinstance(token, list) else 1
+	return count
+
+def tracedBytes(function):
+	# How many bytes the objects function returns are still holding once it is done
+	tracemalloc.start()
+	start = tracemalloc.get_traced_memory()[0]
+	result = function()
+	used = tracemalloc.get_traced_memory()[0] - start
+	tracemalloc.stop()
+	return result, used
+
+def iterTokens(lines):
+	for line in lines:
+		for token in line:
+			if isinstance(token, list):
+				yield from iterTokens([token])
+			else:
+				yield token
+
+def slotNames(cls):
+	return [name for klass in reversed(cls.__mro__) for name in klass.__dict__.get('__slots__', ())]
+
+DICT_CLASSES = {}
+
+def rebuild(obj, cls):
+	# A new cls with the same attributes as obj
+	new_obj = object.__new__(cls)
+	for name in slotNames(type(obj)):
+		if hasattr(obj, name):
+			setattr(new_obj, name, getattr(obj, name))
+	return new_obj
+
+def withDict(obj):
+	# The same object as a plain class which keeps its attributes in a __dict__, like before the classes had __slots__
+	if type(obj) not in DICT_CLASSES:
+		DICT_CLASSES[type(obj)] = type(type(obj).__name__, (), {})
+	return rebuild(obj, DICT_CLASSES[type(obj)])
+
+def bytesEach(objs, make):
+	# How many bytes each object takes on its own, the objects it points to are shared with the originals
+	copies, used = tracedBytes(lambda: [make(obj) for obj in objs])
+	return (used - sys.getsizeof(copies)) / len(copies)
+
+def benchMemory():
+	text = '\n'.join([LOOP_PROGRAM] * 200)
+	print(f'Memory used by the tokens, AST and values of a {len(text) / 1e3:.0f}KB script')
+	(tokens, error), token_bytes = tracedBytes(lambda: engpy.Lexer('<bench>', text).makeTokens())
+	(stream, error), stream_bytes = tracedBytes(lambda: engpy.Lexer('<bench>', text).makeTokenStream())
+	(program, error, remaining_tokens), node_bytes = tracedBytes(lambda: engpy.Parser(stream).parseProgram())
+	values, value_bytes = tracedBytes(lambda: [n + 1000 for n in range(10000)])
+
+	token_count = countTokens(tokens)
+	node_count = sum(1 for line in program for node in engpy.iterNodes(line))
+	print(f'{"tokens":>8}: {token_bytes / token_count:.0f} bytes each as Token objects ({token_count} tokens, source is {len(text) / token_count:.1f} bytes per token)')
+	print(f'{"stream":>8}: {stream_bytes / len(stream):.0f} bytes each in a TokenStream ({len(stream.table)} different names and literals)')
+	print(f'{"nodes":>8}: {node_bytes / node_count:.0f} bytes each ({node_count} nodes)')
+	print(f'{"values":>8}: {value_bytes / len(values):.0f} bytes each')
+
+	print('Bytes for each object with __slots__ and with a __dict__')
+	token_objs = list(iterTokens(tokens))
+	position_objs = [token.pos_start for token in token_objs]
+	node_objs = [node for line in program for node in engpy.iterNodes(line)]
+	for name, objs in [('Token', token_objs), ('Position', position_objs), ('nodes', node_objs)]:
+		slots_bytes = bytesEach(objs, lambda obj: rebuild(obj, type(obj)))
+		dict_bytes = bytesEach(objs, withDict)
+		print(f'{name:>8}: {slots_bytes:.0f} bytes with __slots__, {dict_bytes:.0f} bytes with a __dict__ ({dict_bytes / slots_bytes:.1f}x)')
+
+class GetattrInterpreter(engpy.Interpreter):
+	# Finds the method for each node the way Interpreter.visit did before it had a dispatch table
+	def visit(self, node):
+		method = getattr(self, f'visit_{type(node).__name__}', None)
+		if method is None:
+			method = engpy.findNodeMethod(self, 'visit_', node) or self.noVisitMethod
+		return method(node)
+
+class CountingInterpreter(engpy.Interpreter):
+	visits = 0
+
+	def visit(self, node):
+		self.visits += 1
+		return super().visit(node)
+
+def benchVisits():
+	text = '''x EQUALS 0
+FOR i FROM 0 TO 20000 [
+	x EQUALS x ADD i MULTIPLY 2 MINUS (LENGTH "abc")
+	IF x MORETHAN 100 [
+		y EQUALS x DIVIDE 2
+	]
+]'''
+	program, error, remaining_tokens = engpy.parseText('<bench>', text)
+	counter = CountingInterpreter(tiering=False, values=[None] * len(program.names))
+	for node in program:
+		counter.execute(node)
+	print(f'Tree interpreter on a loop, {counter.visits} visits')
+
+	timings = {}
+	for name, interpreter_class in [('getattr', GetattrInterpreter), ('table', engpy.Interpreter)]:
+		interpreter = interpreter_class(tiering=False, values=[None] * len(program.names))
+		start = time.perf_counter()
+		for node in program:
+			interpreter.execute(node)
+		timings[name] = time.perf_counter() - start
+
+	for name, elapsed in timings.items():
+		print(f'{name:>8}: {elapsed:.3f}s  ({counter.visits / elapsed / 1e6:.2f}M visits/s, {timings["getattr"] / elapsed:.2f}x)')
+
+class NameLookupInterpreter(engpy.Interpreter):
+	# Keeps variables in a dictionary keyed by name, the way the Interpreter did before variables had slots
+	def __init__(self, **kwargs):
+		super().__init__(**kwargs)
+		self.variables = {}
+
+	def visit_varAssignNode(self, node):
+		try:
+			val = self.visit(node.node)
+		except engpy.ExecutionError:
+			self.variables.pop(node.varNode.value, None)
+			raise
+		self.variables[node.varNode.value] = val
+		return val
+
+	def visit_varNode(self, node):
+		try:
+			return self.variables[node.node.value]
+		except KeyError:
+			raise engpy.ExecutionError(engpy.RunTimeError(node.pos_start, node.pos_end, f'No variable with name {node.node.value} defined'))
+
+def benchVariables():
+	print('Tree interpreter on a loop which mostly reads and writes variables (60,000 iterations)')
+	text = '''a EQUALS 1
+b EQUALS 2
+c EQUALS 0
+FOR i FROM 0 TO 60000 [
+	c EQUALS a ADD b MINUS 1
+	a EQUALS b
+	b EQUALS c MINUS a ADD 1
+]'''
+	program, error, remaining_tokens = engpy.parseText('<bench>', text)
+	timings = {}
+	for name, interpreter_class in [('names', NameLookupInterpreter), ('slots', engpy.Interpreter)]:
+		interpreter = interpreter_class(tiering=False, values=[None] * len(program.names))
+		start = time.perf_counter()
+		for node in program:
+			interpreter.execute(node)
+		timings[name] = time.perf_counter() - start
+
+	for name, elapsed in timings.items():
+		print(f'{name:>8}: {elapsed:.3f}s  ({timings["names"] / elapsed:.2f}x)')
+
+THREAD_PROGRAM = '''x EQUALS 0
+FOR i FROM 0 TO 300 [
+	x EQUALS x ADD n MULTIPLY i
+	IF i SAMEAS n [
+		OUTPUT "n reached at " JOIN "x"
+		OUTPUT x
+	]
+]
+OUTPUT x
+OUTPUT n'''
+
+def runInContext(engine, n):
+	# Every task gets its own Context, the programs all use the same variable names so any sharing would show up
+	output = engpy.CollectedOutput()
+	context = engpy.Context(engine=engine, output=output)
+	context.variables['n'] = n
+	result, error = context.run('<bench>', THREAD_PROGRAM)
+	if error:
+		output.write(error.asString(noArrows=True) if isinstance(error, engpy.Error) else error)
+	return output.getvalue()
+
+def benchThreads():
+	print('Contexts run from a pool of 8 threads (400 programs per engine)')
+	tasks = [n % 250 for n in range(400)]
+	for engine in engpy.ENGINES:
+		expected = {n: runInContext(engine, n) for n in set(tasks)}
+		with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+			start = time.perf_counter()
+			outputs = list(pool.map(runInContext, [engine] * len(tasks), tasks))
+			elapsed = time.perf_counter() - start
+		matches = sum(output == expected[n] for output, n in zip(outputs, tasks))
+		print(f'{engine:>8}: {elapsed:.3f}s  {len(tasks) / elapsed:.0f} programs/s  {matches}/{len(tasks)} outputs match')
+
+class PrintOutput(engpy.OutputSink):
+	# How output was written before there were sinks, one print call for every line
+	def __init__(self, file):
+		self.file = file
+
+	def write(self, value):
+		print(value, file=self.file)
+
+def benchOutput():
+	print('Loop which outputs 200,000 lines to a line buffered file, like a terminal')
+	text = '''x EQUALS 0
+FOR i FROM 0 TO 200000 [
+	x EQUALS x ADD i
+	OUTPUT x
+]'''
+	with tempfile.TemporaryFile('w+', buffering=1) as file:
+		sinks = [
+			('print', lambda: PrintOutput(file)),
+			('buffered', lambda: engpy.BufferedOutput(file)),
+			('collected', engpy.CollectedOutput),
+		]
+		for engine in ['tree', 'closure']:
+			timings = {}
+			for name, makeSink in sinks:
+				context = engpy.Context(engine=engine, output=makeSink())
+				start = time.perf_counter()
+				context.run('<bench>', text)
+				timings[name] = time.perf_counter() - start
+			for name, elapsed in timings.items():
+				print(f'{engine:>8} {name:>9}: {elapsed:.3f}s  ({timings["print"] / elapsed:.1f}x)')
+
+def peakBytes(function):
+	# The most memory which was in use at any point while function ran
+	tracemalloc.start()
+	start = time.perf_counter()
+	result, error = function()
+	elapsed = time.perf_counter() - start
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	if error:
+		print(error.asString(noArrows=True) if isinstance(error, engpy.Error) else error)
+	return peak, elapsed
+
+def benchStream():
+	with tempfile.TemporaryDirectory() as directory:
+		path = f'{directory}/generated.txt'
+		with open(path, 'w') as file:
+			for n in range(5000):
+				name = 'x' + 'abcdefghij'[n % 10]
+				file.write(f'{name} EQUALS {n}\nFOR j FROM 0 TO 3 [\n\ty EQUALS {name} ADD j\n]\n')
+		print(f'Peak memory running a generated {os.path.getsize(path) / 1e6:.1f}MB script (10,000 statements)')
+
+		def runWhole():
+			with open(path) as file:
+				return engpy.Context(output=engpy.CollectedOutput()).run(path, file.read().strip())
+
+		def runStreamed():
+			with open(path) as file:
+				return engpy.Context(output=engpy.CollectedOutput()).runStream(path, file)
+
+		timings = {}
+		for name, function in [('whole', runWhole), ('streamed', runStreamed)]:
+			engpy.PARSE_CACHE.clear()
+			timings[name] = peakBytes(function)
+		engpy.PARSE_CACHE.clear()
+
+		for name, (peak, elapsed) in timings.items():
+			print(f'{name:>8}: {peak / 1e6:.2f}MB peak  {elapsed:.3f}s')
+
+def benchMappedSource():
+	with tempfile.TemporaryDirectory() as directory:
+		path = f'{directory}/large.txt'
+		with open(path, 'w') as file:
+			for n in range(100):
+				file.write(LOOP_PROGRAM + '\n')
+				file.write(f'name EQUALS "a long string literal to make the text bigger {n}"\n' * 200)
+		print(f'Peak memory lexing a {os.path.getsize(path) / 1e6:.1f}MB file, the tokens are the same in both')
+
+		def lexText():
+			with open(path) as file:
+				text = file.read().strip()
+			stream, error = engpy.Lexer(path, text).makeTokenStream()
+			return None, error
+
+		def lexMapped():
+			with engpy.openSource(path) as text:
+				stream, error = engpy.Lexer(path, text).makeTokenStream()
+				return None, error
+
+		timings = {}
+		for name, function in [('str', lexText), ('mmap', lexMapped)]:
+			timings[name] = peakBytes(function)
+
+		for name, (peak, elapsed) in timings.items():
+			print(f'{name:>8}: {peak / 1e6:.2f}MB peak  {elapsed:.3f}s')
+
+BENCHMARKS = {
+	'engines': benchEngines,
+	'repeat': benchRepeatedRuns,
+	'optimizer': benchOptimizer,
+	'invariants': benchInvariants,
+	'switch': benchSwitch,
+	'lexer': benchLexer,
+	'parser': benchParser,
+	'cache': benchCache,
+	'parsecache': benchParseCache,
+	'memory': benchMemory,
+	'visits': benchVisits,
+	'variables': benchVariables,
+	'threads': benchThreads,
+	'output': benchOutput,
+	'stream': benchStream,
+	'mmap': benchMappedSource,
+}
+
+if __name__ == '__main__':
+	names = sys.argv[1:] or list(BENCHMARKS)
+	for name in names:
+		BENCHMARKS[name]()
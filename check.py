@@ -0,0 +1,91 @@
+import contextlib
+import io
+import sys
+
+import engpy
+
+def runOutput(text, **kwargs):
+	# Everything the program prints, including the error it stops with
+	engpy.VARS_SAVED.clear()
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output):
+		result, error = engpy.run('<check>', text, **kwargs)
+		if error:
+			print(error.asString(noArrows=True) if isinstance(error, engpy.Error) else error)
+	return output.getvalue()
+
+def sameOnEveryEngine(text):
+	# The unoptimized tree interpreter is what every engine at every optimization level has to match
+	expected = runOutput(text, engine='tree', opt_level=0)
+	failures = []
+	for engine in engpy.ENGINES:
+		for opt_level in [0, 1, 2]:
+			output = runOutput(text, engine=engine, opt_level=opt_level)
+			if output != expected:
+				failures.append(f'{engine} -O{opt_level} printed {output!r}, expected {expected!r}')
+	return failures
+
+def checkStringRepeatType():
+	# A string multiplied by a number is still a string, so comparing it to a number has to fail
+	return sameOnEveryEngine('''s EQUALS "ab"
+y EQUALS 1
+y EQUALS s MULTIPLY 2
+OUTPUT y SAMEAS 4''')
+
+def checkNestedInvariants():
+	# j MINUS i has to be worked out again every time the middle loop starts
+	return sameOnEveryEngine('''FOR i FROM 0 TO 2 [
+	FOR j FROM 0 TO 2 [
+		FOR k FROM 0 TO 1 [
+			OUTPUT j MINUS i
+		]
+	]
+]''')
+
+class CountingOptimizer(engpy.Optimizer):
+	def __init__(self, *args):
+		super().__init__(*args)
+		self.visits = 0
+
+	def hoistExpr(self, node, loops, limit):
+		self.visits += 1
+		return super().hoistExpr(node, loops, limit)
+
+def nestedLoops(depth):
+	lines = ['total EQUALS 0']
+	for level in range(depth):
+		name = 'i' + ''.join(chr(ord('a') + int(digit)) for digit in str(level))
+		lines.append(f'FOR {name} FROM 0 TO 1 [')
+		lines.append(f'total EQUALS total ADD {name} MULTIPLY 2')
+	lines += [']'] * depth
+	return '\n'.join(lines)
+
+def checkNestedHoisting():
+	# Every expression in a loop should only be visited once however deep the loops are nested
+	visits = []
+	for depth in [20, 40, 80]:
+		stream, error = engpy.Lexer('<check>', nestedLoops(depth)).makeTokenStream()
+		program, error, remaining_tokens = engpy.Parser(stream).parseProgram()
+		optimizer = CountingOptimizer(1, program)
+		optimizer.optimizeProgram(program)
+		visits.append(optimizer.visits)
+	if visits[2] - visits[1] != 2 * (visits[1] - visits[0]):
+		return [f'hoisting visited {visits} expressions for 20, 40 and 80 nested loops']
+	return []
+
+CHECKS = {
+	'types': checkStringRepeatType,
+	'invariants': checkNestedInvariants,
+	'nesting': checkNestedHoisting,
+}
+
+if __name__ == '__main__':
+	names = sys.argv[1:] or list(CHECKS)
+	failed = False
+	for name in names:
+		failures = CHECKS[name]()
+		print(f'{name}: {"FAILED" if failures else "ok"}')
+		for failure in failures:
+			print(f'   {failure}')
+		failed = failed or bool(failures)
+	sys.exit(1 if failed else 0)
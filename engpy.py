@@ -1,10 +1,28 @@
+import array
+import bisect
+import collections.abc
+import contextlib
+import copy
+import functools
+import hashlib
+import math
+import mmap
+import operator
+import os
+import pickle
+import re
 import string
-import string
+import sys
+import tempfile
+import threading
+import zlib
 
 ################
 # CONSTANTS
 ################
 
+__version__ = '0.1.0'
+
 DIGITS = '0123456789'
 VARCHARS = string.ascii_letters + '_'
 STRINGCHARS = string.printable + '£'
@@ -13,6 +31,7 @@ STRINGCHARS = string.printable + '£'
 T_INT = 'INT'
 T_FLOAT = 'FLOAT'
 T_STRING = 'STRING'
+T_BOOLEAN = 'BOOLEAN'
 
 # Operation tokens
 T_ADD = 'ADD'
@@ -25,6 +44,7 @@ T_LPAREN = 'LPAREN'
 T_RPAREN = 'RPAREN'
 T_LSBRACK = 'LSBRACK'
 T_RSBRACK = 'RSBRACK'
+T_BLOCK = 'BLOCK'
 
 # Conditional tokens
 T_LESSTHAN = 'LESSTHAN'
@@ -50,7 +70,54 @@ T_BREAK = 'BREAK'
 
 T_EOF = 'EOF'
 
-VARS_SAVED = {}
+KEYWORDS = {keyword: keyword for keyword in [
+	T_ADD, T_MINUS, T_MULTIPLY, T_DIVIDE, T_EQUALS, T_LENGTH, T_JOIN, T_OUTPUT,
+	T_LESSTHAN, T_MORETHAN, T_LESSEQUALS, T_MOREEQUALS, T_SAMEAS, T_NOTSAMEAS,
+	T_IF, T_ELSEIF, T_ELSE, T_FOR, T_FROM, T_TO, T_BREAK,
+]}
+
+SYMBOLS = {
+	'-': T_MINUS,
+	'(': T_LPAREN,
+	')': T_RPAREN,
+}
+
+# Every type of token a TokenStream can hold, it stores the index of the type instead of the type itself
+TOKEN_KINDS = [T_INT, T_FLOAT, T_STRING, T_VAR, *KEYWORDS, T_LPAREN, T_RPAREN, T_LSBRACK, T_RSBRACK, T_EOF, T_BLOCK]
+KIND_CODES = {type_: code for code, type_ in enumerate(TOKEN_KINDS)}
+KIND_EOF = KIND_CODES[T_EOF]
+KIND_BLOCK = KIND_CODES[T_BLOCK]
+
+# Matches one token (or run of spaces) at a time, which group matched says what it is. A string with no closing quote
+# still matches so the error can point at where it stopped
+TOKEN_REGEX = re.compile(
+	r'(?P<SPACE>[ \t]+)'
+	r'|(?P<NEWLINE>\n)'
+	r'|(?P<NUMBER>[0-9]+(?:\.[0-9]*)?)'
+	r'|(?P<WORD>[A-Za-z_]+)'
+	r'|(?P<STRING>"[' + ''.join(re.escape(char) for char in STRINGCHARS if char != '"') + r']*"?)'
+	r'|(?P<SYMBOL>[-()])'
+	r'|(?P<BLOCK>[\[\]])'
+)
+
+# The same for text which is still bytes, such as a memory mapped file. The only character in STRINGCHARS which is more
+# than one byte long is '£', so it is matched as its own UTF-8 bytes. A file read as a str has its '\r\n' and '\r' line
+# endings turned into '\n', bytes have not, so they are all new lines here
+BYTES_NEWLINE_REGEX = re.compile(rb'\r\n|\r|\n')
+TOKEN_BYTES_REGEX = re.compile(
+	rb'(?P<SPACE>[ \t]+)'
+	rb'|(?P<NEWLINE>\r\n|\r|\n)'
+	rb'|(?P<NUMBER>[0-9]+(?:\.[0-9]*)?)'
+	rb'|(?P<WORD>[A-Za-z_]+)'
+	rb'|(?P<STRING>"(?:[' + ''.join(re.escape(char) for char in STRINGCHARS if char.isascii() and char != '"').encode() + rb']|' + '£'.encode() + rb')*"?)'
+	rb'|(?P<SYMBOL>[-()])'
+	rb'|(?P<BLOCK>[\[\]])'
+)
+BYTES_KEYWORDS = {keyword.encode(): type_ for keyword, type_ in KEYWORDS.items()}
+BYTES_SYMBOLS = {symbol.encode(): type_ for symbol, type_ in SYMBOLS.items()}
+
+# Number of iterations after which a FOR loop in the Interpreter is compiled
+TIER_THRESHOLD = 100
 
 ################
 # ERROR CLASSES
@@ -94,22 +161,35 @@ class RunTimeError(Error):
 	def __init__(self, pos_start, pos_end, details):
 		super().__init__(pos_start, pos_end, 'Runtime error', details)
 
+class ExecutionError(Exception):
+	# Raised with an Error while a program runs, the engines turn it back into a RunTimeResult at the top of each statement
+	def __init__(self, error):
+		super().__init__(error)
+		self.error = error
+
+class ParseError(TypeError):
+	# Raised when the parser cannot go any further into a line, the lines before it are run before it is raised again
+	pass
+
 ################
 # BASIC CLASSES
 ################
 
 class Token:
+	__slots__ = ('type', 'value', 'pos_start', 'pos_end')
+
 	def __init__(self, type_, value=None, pos_start=None, pos_end=None):
 		self.type = type_
 		self.value = value
 
+		# Positions never change once they are made, so they are shared instead of copied
 		if pos_start:
-			self.pos_start = pos_start.copy()
-			self.pos_end = pos_start.copy()
-			self.pos_end.advance()
+			self.pos_start = pos_start
+			if not pos_end:
+				self.pos_end = pos_start.advance()
 
 		if pos_end:
-			self.pos_end = pos_end.copy()
+			self.pos_end = pos_end
 
 	def __repr__(self):
 		if self.value != None: 
@@ -119,218 +199,361 @@ class Token:
 		return f'{self.type}'
 
 
-class Position:
-	def __init__(self, index, line_number, column, file_name, file_text):
-		self.idx = index
-		self.ln = line_number
-		self.col = column
+class SourceFile:
+	# The text is a str, or bytes (any bytes-like object such as a memoryview of a memory mapped file) in UTF-8
+	__slots__ = ('fn', 'ft', 'line_starts', 'first_line')
+
+	def __init__(self, file_name, file_text, first_line=0):
 		self.fn = file_name
 		self.ft = file_text
+		# The index each line starts at, only worked out the first time a line or column is needed
+		self.line_starts = None
+		# The line of the file the text starts on, when the text is only one statement of it
+		self.first_line = first_line
+
+	def lineAndColumn(self, idx):
+		text = self.ft
+		if self.line_starts is None:
+			# The lexer acts as if the text ends with a new line, so there is a line start after that too
+			newline = re.compile('\n') if isinstance(text, str) else BYTES_NEWLINE_REGEX
+			self.line_starts = [0] + [match.end() for match in newline.finditer(text)] + [len(text) + 1]
+		ln = bisect.bisect_right(self.line_starts, idx) - 1
+		line_start = self.line_starts[ln]
+		if isinstance(text, str) or idx > len(text):
+			return ln + self.first_line, idx - line_start
+		# idx counts bytes, the column counts characters
+		return ln + self.first_line, len(str(text[line_start:idx], 'utf-8', 'replace'))
+
+	def __getstate__(self):
+		# A memoryview can not be pickled, so a ProgramCache stores a copy of its bytes
+		text = self.ft if isinstance(self.ft, (str, bytes)) else bytes(self.ft)
+		return None, {'fn': self.fn, 'ft': text, 'line_starts': self.line_starts, 'first_line': self.first_line}
 
-	def advance(self, current_char=None):
-		self.idx += 1
-		self.col += 1
 
-		if current_char == '\n':
-			self.ln += 1
-			self.col = 0
+class Position:
+	# A position is just an index into the text of a SourceFile, the line and column are worked out from it when they are used
+	__slots__ = ('idx', 'source')
 
-		return self
-	
-	def copy(self):
-		return Position(self.idx, self.ln, self.col, self.fn, self.ft)
+	def __init__(self, index, source):
+		self.idx = index
+		self.source = source
+
+	@property
+	def ln(self):
+		return self.source.lineAndColumn(self.idx)[0]
+
+	@property
+	def col(self):
+		return self.source.lineAndColumn(self.idx)[1]
+
+	@property
+	def fn(self):
+		return self.source.fn
+
+	@property
+	def ft(self):
+		return self.source.ft
+
+	def advance(self):
+		return Position(self.idx + 1, self.source)
 
 	def __repr__(self):
 		return f'idx:{self.idx}, ln:{self.ln}, col:{self.col}'
 
+
+class TokenStream:
+	# All the tokens of a program in parallel arrays instead of a Token object each. kinds is the index of the type in
+	# TOKEN_KINDS, starts and ends are offsets into the text and values is the index of the value in table, or -1 when the
+	# token has none. Every name and literal is only put in table once however many times it is used.
+	# A code block is a BLOCK token straight after its '[', followed by the lines in the block and then its ']'. The value
+	# of a BLOCK token is the index of that ']' instead, so a line can skip over the blocks in it
+	__slots__ = ('source', 'kinds', 'starts', 'ends', 'values', 'table')
+
+	def __init__(self, source):
+		self.source = source
+		self.kinds = array.array('B')
+		# Offsets take 4 bytes each unless the text is 4GB or more, and there can not be more tokens than bytes
+		size = len(source.ft) + 1
+		self.starts = array.array('I' if size < 2 ** 32 else 'Q')
+		self.ends = array.array(self.starts.typecode)
+		self.values = array.array('i' if size < 2 ** 31 else 'q')
+		self.table = []
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def add(self, kind, start, end, value=-1):
+		self.kinds.append(kind)
+		self.starts.append(start)
+		self.ends.append(end)
+		self.values.append(value)
+
+	def token(self, idx):
+		# Makes a Token for the parser, only done for tokens which end up in a node or an error
+		kind = self.kinds[idx]
+		value = self.values[idx]
+		source = self.source
+		return Token(TOKEN_KINDS[kind], self.table[value] if value >= 0 and kind != KIND_BLOCK else None, Position(self.starts[idx], source), Position(self.ends[idx], source))
+
+	def lineElements(self, idx):
+		# The index of every token in the line starting at idx up to its EOF, a block in the line is just its BLOCK token
+		elements = []
+		kinds = self.kinds
+		while True:
+			elements.append(idx)
+			kind = kinds[idx]
+			if kind == KIND_EOF:
+				return elements
+			idx = self.values[idx] if kind == KIND_BLOCK else idx + 1
+
+	def toLines(self, start=0, end=None):
+		# The tokens as lists of Token objects, one list for each line with a code block being a list of its lines
+		lines = []
+		tokens = []
+		idx = start
+		end = len(self) if end is None else end
+		while idx < end:
+			kind = self.kinds[idx]
+			if kind == KIND_BLOCK:
+				tokens.append(self.toLines(idx + 1, self.values[idx]))
+				idx = self.values[idx]
+				continue
+
+			tokens.append(self.token(idx))
+			if kind == KIND_EOF:
+				lines.append(tokens)
+				tokens = []
+			idx += 1
+		return lines
+
+
+class VariableSlots:
+	# Gives every variable name in one program a slot the first time the Parser sees it, which is the index of its value
+	# in the frame the program runs with. Each Parser has its own, so nothing is kept for names once their program is gone
+	def __init__(self):
+		self.slots = {}
+		self.names = []
+
+	def slot(self, name):
+		slot = self.slots.get(name)
+		if slot is None:
+			slot = self.slots[name] = len(self.names)
+			self.names.append(name)
+		return slot
+
+
+class Variables(collections.abc.MutableMapping):
+	# The saved variables, used like a dictionary from name to value. A program is run with a frame, a list holding the
+	# value of each of its names at that name's slot, and the engines read and write variables through the frame.
+	# A slot holding None has no variable in it
+	__slots__ = ('values',)
+
+	def __init__(self):
+		self.values = {}
+
+	def frame(self, names):
+		values = self.values
+		return [values.get(name) for name in names]
+
+	def store(self, names, frame):
+		# Writes a frame back once its program has stopped running
+		values = self.values
+		for name, value in zip(names, frame):
+			if value is None:
+				values.pop(name, None)
+			else:
+				values[name] = value
+
+	def __getitem__(self, name):
+		return self.values[name]
+
+	def __setitem__(self, name, value):
+		self.values[name] = value
+
+	def __delitem__(self, name):
+		del self.values[name]
+
+	def __iter__(self):
+		return iter(self.values)
+
+	def __len__(self):
+		return len(self.values)
+
+	def clear(self):
+		self.values.clear()
+
+	def __repr__(self):
+		return repr(self.values)
+
+# The variables of the default Context, which run uses when it is not given one
+VARS_SAVED = Variables()
+
 ################
 # LEXER
 ################
 
+def decodeBytes(lexeme):
+	# A string can run over more than one line, its line endings become '\n' the same as when a file is read as a str
+	if b'\r' in lexeme:
+		lexeme = BYTES_NEWLINE_REGEX.sub(b'\n', lexeme)
+	return str(lexeme, 'utf-8')
+
 class Lexer:
-	def __init__(self, file_name, text, pos=None):
+	# text can also be bytes in UTF-8, or anything bytes-like such as the memoryview openSource gives back. Only the names
+	# and strings which end up in tokens are decoded
+	def __init__(self, file_name, text, first_line=0):
 		self.fn = file_name
-		self.text = text + '\n'
-		if pos:
-			self.pos = pos
-		else:
-			self.pos = Position(-1, 0, -1, self.fn, text)
-		self.current_char = None
-		self.total_tokens = []
-		self.advance()
-
-	def advance(self):
-		self.pos.advance(self.current_char)
-		self.current_char = self.text[self.pos.idx] if self.pos.idx < len(self.text) else None
-		return self.current_char
+		self.text = text
+		self.source = SourceFile(file_name, text, first_line)
+		self.pos = Position(0, self.source)
+		self.stream = TokenStream(self.source)
 
 	def makeTokens(self, internalCall=False):
-		tokens = []
-		while self.current_char != None:
-			# print(repr(self.current_char), tokens)
-			if self.current_char in ' \t':
-				self.advance()
-			elif self.current_char in '\n':
-				if tokens:
-					tokens.append(Token(T_EOF, pos_start=self.pos))
-					self.total_tokens.append(tokens)
-				tokens = [] 
-				self.advance()
-			elif self.current_char == '"':
-				pos_start = self.pos.copy()
-				s = self.makeString()
-				if s[0] == 'error':
-					return [], InvalidSyntaxError(pos_start, self.pos, s[1])
+		# The tokens as lists of Token objects, a line for each list. The parser reads a TokenStream instead
+		stream, error = self.makeTokenStream()
+		if error: return [], error
+		return stream.toLines(), None
+
+	def makeTokenStream(self):
+		stream = self.stream
+		add = stream.add
+		table = stream.table
+		# Where each name or literal is in table, keyed by its text
+		interned = {}
+		# Where the current line starts in the stream, and for every block that is still open where its BLOCK token is
+		# and where the line it is in starts
+		line_start = 0
+		blocks = []
+		text = self.text
+		source = self.source
+		idx = self.pos.idx
+		# Bytes are scanned with the bytes versions of the regular expression and tables, and names and strings are decoded
+		# when they are first put in table
+		if isinstance(text, str):
+			token_regex, keywords, symbols, dot, quote, open_bracket, decode = TOKEN_REGEX, KEYWORDS, SYMBOLS, '.', '"', '[', str
+		else:
+			token_regex, keywords, symbols, dot, quote, open_bracket = TOKEN_BYTES_REGEX, BYTES_KEYWORDS, BYTES_SYMBOLS, b'.', b'"', b'['
+			decode = decodeBytes
+
+		while idx < len(text):
+			match = token_regex.match(text, idx)
+			if match is None:
+				pos_start = Position(idx, source)
+				self.pos = pos_start.advance()
+				return None, IllegalCharError(pos_start, self.pos, "'" + self.characterAt(idx) + "'")
+
+			kind = match.lastgroup
+			end = match.end()
+			if kind == 'SPACE':
+				pass
+			elif kind == 'NEWLINE':
+				if len(stream) > line_start:
+					add(KIND_EOF, idx, end)
+					line_start = len(stream)
+			elif kind == 'NUMBER':
+				lexeme = match.group()
+				value = interned.get(lexeme)
+				if value is None:
+					value = interned[lexeme] = len(table)
+					table.append(float(lexeme) if dot in lexeme else int(lexeme))
+				add(KIND_CODES[T_FLOAT] if dot in lexeme else KIND_CODES[T_INT], idx, end, value)
+			elif kind == 'WORD':
+				word = match.group()
+				keyword = keywords.get(word)
+				if keyword:
+					add(KIND_CODES[keyword], idx, end)
 				else:
-					tokens.append(s[0])
-			elif self.current_char in DIGITS:
-				tokens.append(self.makeNumber())
-			elif self.current_char in VARCHARS:
-				tokens.append(self.makeKeywordToken())
-			elif self.current_char == '-':
-				tokens.append(Token(T_MINUS, pos_start=self.pos))
-				self.advance()
-			elif self.current_char == '(':
-				tokens.append(Token(T_LPAREN, pos_start=self.pos))
-				self.advance()
-			elif self.current_char == ')':
-				tokens.append(Token(T_RPAREN, pos_start=self.pos))
-				self.advance()
-			elif self.current_char == '[':
-				tokens.append(Token(T_LSBRACK, pos_start=self.pos))
-				res, error, pos = self.makeCodeBlock()
-				self.pos.ln = pos[1] - 1
-				self.pos.col = pos[2]
-				if error: return [], error
-
-				tokens.append(res)
-				tokens.append(Token(T_RSBRACK, pos_start=self.pos))
-				self.advance()
-			elif self.current_char == ']':
-				tokens.append(Token(T_RSBRACK, pos_start=self.pos))
-				self.advance()
+					value = interned.get(word)
+					if value is None:
+						value = interned[word] = len(table)
+						table.append(decode(word))
+					add(KIND_CODES[T_VAR], idx, end, value)
+			elif kind == 'STRING':
+				lexeme = match.group()
+				if len(lexeme) == 1 or not lexeme.endswith(quote):
+					if end == len(text):
+						# The string ran into the end of the text, and would have taken the new line after it too
+						end += 1
+					self.pos = Position(end, source)
+					return None, InvalidSyntaxError(Position(idx, source), self.pos, 'Expected ' + '"')
+				# The quotes are kept in the key so a string never shares an entry with a name
+				value = interned.get(lexeme)
+				if value is None:
+					value = interned[lexeme] = len(table)
+					table.append(decode(lexeme[1:-1]))
+				add(KIND_CODES[T_STRING], idx, end, value)
+			elif kind == 'SYMBOL':
+				add(KIND_CODES[symbols[match.group()]], idx, end)
+			elif match.group() == open_bracket:
+				# A nested block is lexed in the same pass, the line the block is in carries on after its ']'
+				add(KIND_CODES[T_LSBRACK], idx, end)
+				blocks.append((len(stream), line_start))
+				add(KIND_BLOCK, idx, end)
+				line_start = len(stream)
+			elif blocks:
+				error = self.closeBlock(blocks, line_start, idx, end)
+				if error: return None, error
+				line_start = blocks.pop()[1]
 			else:
-				pos_start = self.pos.copy()
-				char = self.current_char
-				self.advance()
-				return [], IllegalCharError(pos_start, self.pos, "'" + char + "'")
-
-		if self.total_tokens:
-			if self.total_tokens[-1][-1].type != T_EOF:
-				self.total_tokens[-1].append(Token(T_EOF, pos_start=self.pos))
-			return self.total_tokens, None
+				add(KIND_CODES[T_RSBRACK], idx, end)
+			idx = end
+
+		# The text is lexed as if it ended with a new line, without making a copy of it with one added
+		if len(stream) > line_start:
+			add(KIND_EOF, idx, idx + 1)
+			line_start = len(stream)
+		idx += 1
+
+		self.pos = Position(idx, source)
+		# Any blocks left open are closed at the end of the text
+		while blocks:
+			error = self.closeBlock(blocks, line_start, idx, idx)
+			if error: return None, error
+			line_start = blocks.pop()[1]
+		if len(stream) > line_start:
+			add(KIND_EOF, idx, idx + 1)
+
+		if len(stream):
+			return stream, None
 		else:
-			return [], RunTimeError(self.pos, self.pos, 'No text found')
-
-	def makeNumber(self):
-		num = ''
-		decimal = 0
-		pos_start = self.pos.copy()
-		while self.current_char != None and self.current_char in DIGITS + '.':
-			if self.current_char == '.':
-				if decimal == 1: break
-				decimal += 1
-				num += '.'
-			else:
-				num += self.current_char
-			self.advance()
-		return Token(T_INT, int(num), pos_start, self.pos) if decimal == 0 else Token(T_FLOAT, float(num), pos_start, self.pos)
-
-	def makeKeywordToken(self):
-		kword = ''
-		pos_start = self.pos.copy()
-		while self.current_char != None and self.current_char in VARCHARS:
-			kword += self.current_char
-			self.advance()
-
-		if kword == T_ADD: return Token(T_ADD, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_MINUS: return Token(T_MINUS, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_MULTIPLY: return Token(T_MULTIPLY, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_DIVIDE: return Token(T_DIVIDE, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_EQUALS: return Token(T_EQUALS, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_LENGTH: return Token(T_LENGTH, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_JOIN: return Token(T_JOIN, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_OUTPUT: return Token(T_OUTPUT, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_LESSTHAN: return Token(T_LESSTHAN, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_MORETHAN: return Token(T_MORETHAN, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_LESSEQUALS: return Token(T_LESSEQUALS, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_MOREEQUALS: return Token(T_MOREEQUALS, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_SAMEAS: return Token(T_SAMEAS, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_NOTSAMEAS: return Token(T_NOTSAMEAS, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_IF: return Token(T_IF, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_ELSEIF: return Token(T_ELSEIF, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_ELSE: return Token(T_ELSE, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_FOR: return Token(T_FOR, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_FROM: return Token(T_FROM, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_TO: return Token(T_TO, pos_start=pos_start, pos_end=self.pos)
-		elif kword == T_BREAK: return Token(T_BREAK, pos_start=pos_start, pos_end=self.pos)
-		else: return Token(T_VAR, value=kword, pos_start=pos_start, pos_end=self.pos)
-
-	def makeString(self):
-		string = ''
-		quotes_num = 0
-		pos_start = self.pos.copy()
-		while self.current_char != None and self.current_char in STRINGCHARS:
-			if self.current_char == '"':
-				quotes_num += 1
-				if quotes_num == 2:
-					self.advance()
-					break
-			else:
-				string += self.current_char
-			self.advance()
+			return None, RunTimeError(self.pos, self.pos, 'No text found')
 
-		if quotes_num == 1:
-			return 'error', 'Expected ' + '"'
+	def closeBlock(self, blocks, line_start, start, end):
+		stream = self.stream
+		if len(stream) > line_start:
+			stream.add(KIND_EOF, start, end)
 
-		return Token(T_STRING, value=string, pos_start=pos_start, pos_end=self.pos), None
+		block = blocks[-1][0]
+		if len(stream) == block + 1:
+			return RunTimeError(Position(start, self.source), Position(end, self.source), 'No text found')
+		stream.values[block] = len(stream)
+		stream.add(KIND_CODES[T_RSBRACK], start, end)
 
-	def makeCodeBlock(self):
-		ln = self.pos.ln
-		self.advance()
-		text = ''
-		open_sbracks = 0
-		close_sbracks = 0
-		while self.current_char != None:
-			if self.current_char == '\t':
-				self.advance()
-			if self.current_char == '[':
-				open_sbracks += 1
-			if self.current_char == ']':
-				close_sbracks += 1
-				if close_sbracks == open_sbracks:
-					text += ']'
-					self.advance()
-					continue
-				else:
-					break
-			text += self.current_char
-			self.advance()
-
-		# print(text)
-		int_lexer = Lexer('<code_block>', text, pos=Position(-1, ln, -1, self.fn, text))
-		res, error = int_lexer.makeTokens()
-		if error: return [], error, (int_lexer.pos.idx, int_lexer.pos.ln, int_lexer.pos.col)
-		# print(res)
-		
-		return res, None, (int_lexer.pos.idx, int_lexer.pos.ln, int_lexer.pos.col)
-		# Need new line after '['
-		# Go line by line and lex each line into a list for everyline containing all the tokens for that line
+	def characterAt(self, idx):
+		if isinstance(self.text, str):
+			return self.text[idx]
+		# A UTF-8 character is at most 4 bytes long
+		return str(self.text[idx:idx + 4], 'utf-8', 'replace')[0]
 
 ################
 # AST NODE CLASSES
 ################
 
 class BasicNode:
-	output = False
+	# Nodes are made for every part of every line, so they use __slots__ instead of a __dict__ each. The type is
+	# the same for every node of a class so it is a class attribute
+	__slots__ = ('output', 'pos_start', 'pos_end')
 
 	def __repr__(self):
 		return f'{self.type}'
 
 
 class numberNode(BasicNode):
+	__slots__ = ('token',)
+	type = 'numberNode'
+
 	def __init__(self, token):
-		self.type = 'numberNode'
+		self.output = False
 		self.token = token
 		self.pos_start = self.token.pos_start
 		self.pos_end = self.token.pos_end
@@ -340,8 +563,11 @@ class numberNode(BasicNode):
 
 
 class binOpNode(BasicNode):
+	__slots__ = ('left_node', 'op_token', 'right_node')
+	type = 'binOpNode'
+
 	def __init__(self, left_node, op_token, right_node):
-		self.type = 'binOpNode'
+		self.output = False
 		self.left_node = left_node
 		self.op_token = op_token
 		self.right_node = right_node
@@ -353,8 +579,11 @@ class binOpNode(BasicNode):
 
 
 class unaryOpNode(BasicNode):
+	__slots__ = ('op_token', 'node')
+	type = 'unaryOpNode'
+
 	def __init__(self, op_token, node):
-		self.type = 'unaryOpNode'
+		self.output = False
 		self.op_token = op_token
 		self.node = node
 		self.pos_start = self.op_token.pos_start
@@ -365,10 +594,14 @@ class unaryOpNode(BasicNode):
 
 
 class varAssignNode(BasicNode):
-	def __init__(self, varNode, node):
-		self.type = 'varAssignNode'
+	__slots__ = ('varNode', 'node', 'slot')
+	type = 'varAssignNode'
+
+	def __init__(self, varNode, node, slot):
+		self.output = False
 		self.varNode = varNode
 		self.node = node
+		self.slot = slot
 		self.pos_start = self.varNode.pos_start
 		self.pos_end = self.node.pos_end
 
@@ -377,9 +610,13 @@ class varAssignNode(BasicNode):
 
 
 class varNode(BasicNode):
-	def __init__(self, node):
-		self.type = 'varNode'
+	__slots__ = ('node', 'slot')
+	type = 'varNode'
+
+	def __init__(self, node, slot):
+		self.output = False
 		self.node = node
+		self.slot = slot
 		self.pos_start = self.node.pos_start
 		self.pos_end = self.node.pos_end
 
@@ -388,8 +625,11 @@ class varNode(BasicNode):
 
 
 class stringNode(BasicNode):
+	__slots__ = ('token',)
+	type = 'stringNode'
+
 	def __init__(self, token):
-		self.type = 'stringNode'
+		self.output = False
 		self.token = token
 		self.pos_start = self.token.pos_start
 		self.pos_end = self.token.pos_end
@@ -398,9 +638,26 @@ class stringNode(BasicNode):
 		return f'{self.token}'
 
 
+class booleanNode(BasicNode):
+	__slots__ = ('token',)
+	type = 'booleanNode'
+
+	def __init__(self, token):
+		self.output = False
+		self.token = token
+		self.pos_start = self.token.pos_start
+		self.pos_end = self.token.pos_end
+
+	def __repr__(self):
+		return f'{self.token}'
+
+
 class stringLengthNode(BasicNode):
+	__slots__ = ('token',)
+	type = 'stringLengthNode'
+
 	def __init__(self, token):
-		self.type = 'stringLengthNode'
+		self.output = False
 		self.token = token
 		self.pos_start = self.token.pos_start
 		self.pos_end = self.token.pos_end
@@ -410,8 +667,11 @@ class stringLengthNode(BasicNode):
 
 	
 class stringOpNode(BasicNode):
+	__slots__ = ('left_node', 'op_token', 'right_node')
+	type = 'stringOpNode'
+
 	def __init__(self, left_node, op_token, right_node):
-		self.type = 'stringOpNode'
+		self.output = False
 		self.left_node = left_node
 		self.op_token = op_token
 		self.right_node = right_node
@@ -423,8 +683,11 @@ class stringOpNode(BasicNode):
 
 
 class equalityNode(BasicNode):
+	__slots__ = ('left_node', 'op_token', 'right_node')
+	type = 'equalityNode'
+
 	def __init__(self, left_node, op_token, right_node):
-		self.type = 'equalityNode'
+		self.output = False
 		self.left_node = left_node
 		self.op_token = op_token
 		self.right_node = right_node
@@ -436,8 +699,11 @@ class equalityNode(BasicNode):
 
 
 class conditionalNode(BasicNode):
+	__slots__ = ('if_node', 'elseif_nodes', 'else_node')
+	type = 'conditionalNode'
+
 	def __init__(self, if_node, elseif_nodes=None, else_node=None):
-		self.type = 'conditionalNode'
+		self.output = False
 		self.if_node = if_node
 		self.elseif_nodes = []
 		self.else_node = None
@@ -463,99 +729,383 @@ class conditionalNode(BasicNode):
 
 
 class ifNode(BasicNode):
+	__slots__ = ('if_node', 'if_comp_node', 'if_code_nodes')
+	type = 'ifNode'
+
 	def __init__(self, if_node, if_comp_node, if_code_nodes):
-		self.type = 'ifNode'
+		self.output = False
 		self.if_node = if_node
 		self.if_comp_node = if_comp_node
 		self.if_code_nodes = if_code_nodes
 
 
 class elseifNode(BasicNode):
+	__slots__ = ('elseif_node', 'elseif_comp_node', 'elseif_code_nodes')
+	type = 'elseifNode'
+
 	def __init__(self, elseif_node, elseif_comp_node, elseif_code_nodes):
-		self.type = 'elseifNode'
+		self.output = False
 		self.elseif_node = elseif_node
 		self.elseif_comp_node = elseif_comp_node
 		self.elseif_code_nodes = elseif_code_nodes
 
 
 class elseNode(BasicNode):
+	__slots__ = ('else_node', 'else_code_nodes')
+	type = 'elseNode'
+
 	def __init__(self, else_node, else_code_nodes):
-		self.type = 'elseNode'
+		self.output = False
 		self.else_node = else_node
 		self.else_code_nodes = else_code_nodes
 
 
 class forNode(BasicNode):
+	__slots__ = ('var_node', 'from_node', 'to_node', 'code_nodes', 'invariant_nodes')
+	type = 'forNode'
+
 	def __init__(self, var_node, from_node, to_node, code_nodes):
-		self.type = 'forNode'
+		self.output = False
 		self.var_node = var_node
 		self.from_node = from_node
 		self.to_node = to_node
 		self.code_nodes = code_nodes
+		# The invariantNodes in the body whose cached values are thrown away each time the loop starts
+		self.invariant_nodes = []
 
 	def __repr__(self):
 		return f'(for: var:{self.var_node} from:{self.from_node} to:{self.to_node}) code:{self.code_nodes}'
 
 
 class breakNode(BasicNode):
+	__slots__ = ('break_node',)
+	type = 'breakNode'
+
 	def __init__(self, break_node):
-		self.type = 'breakNode'
+		self.output = False
 		self.break_node = break_node
+
+
+class blockNode(BasicNode):
+	__slots__ = ('line_nodes',)
+	type = 'blockNode'
+
+	def __init__(self, line_nodes):
+		self.output = False
+		self.line_nodes = line_nodes
+
+	def __iter__(self):
+		return iter(self.line_nodes)
+
+	def __len__(self):
+		return len(self.line_nodes)
+
+	def __repr__(self):
+		return f'{self.line_nodes}'
+
+
+class programNode(blockNode):
+	# names is the name of the variable in each slot, the Parser gives out slots for one program at a time
+	__slots__ = ('names',)
+	type = 'programNode'
+
+	def __init__(self, line_nodes, names=()):
+		super().__init__(line_nodes)
+		self.names = names
+
+
+class invariantNode(BasicNode):
+	__slots__ = ('node',)
+	type = 'invariantNode'
+
+	def __init__(self, node):
+		self.node = node
+		self.output = node.output
+		self.pos_start = node.pos_start
+		self.pos_end = node.pos_end
+
+	def __repr__(self):
+		return f'Invariant({self.node})'
 		
 
+# The TypeInference pass swaps these in for nodes whose operand types are known, so the type checks can be skipped.
+# An engine without a method for one of them uses the method for the node it subclasses instead
+
+NUMBER_OPERATORS = {
+	T_ADD: operator.add,
+	T_MINUS: operator.sub,
+	T_MULTIPLY: operator.mul,
+	T_DIVIDE: operator.truediv,
+}
+
+COMPARISION_OPERATORS = {
+	T_LESSTHAN: operator.lt,
+	T_MORETHAN: operator.gt,
+	T_LESSEQUALS: operator.le,
+	T_MOREEQUALS: operator.ge,
+	T_SAMEAS: operator.eq,
+	T_NOTSAMEAS: operator.ne,
+}
+
+
+class numberBinOpNode(binOpNode):
+	__slots__ = ('operator',)
+	type = 'numberBinOpNode'
+
+	def __init__(self, left_node, op_token, right_node):
+		super().__init__(left_node, op_token, right_node)
+		self.operator = NUMBER_OPERATORS[op_token.type]
+
+	def __repr__(self):
+		return f'({self.left_node}, {self.op_token}:NUMBER, {self.right_node})'
+
+
+class numberNegateNode(unaryOpNode):
+	__slots__ = ()
+	type = 'numberNegateNode'
+
+	def __repr__(self):
+		return f'({self.op_token}:NUMBER, {self.node})'
+
+
+class stringJoinNode(stringOpNode):
+	__slots__ = ()
+	type = 'stringJoinNode'
+
+	def __repr__(self):
+		return f'({self.left_node}, {self.op_token}:STRING, {self.right_node})'
+
+
+class stringRepeatNode(stringOpNode):
+	__slots__ = ('string_first',)
+	type = 'stringRepeatNode'
+
+	def __init__(self, left_node, op_token, right_node, string_first=True):
+		super().__init__(left_node, op_token, right_node)
+		self.string_first = string_first
+
+	def __repr__(self):
+		return f'({self.left_node}, {self.op_token}:STRING, {self.right_node})'
+
+
+class numberEqualityNode(equalityNode):
+	__slots__ = ('operator',)
+	type = 'numberEqualityNode'
+
+	def __init__(self, left_node, op_token, right_node):
+		super().__init__(left_node, op_token, right_node)
+		self.operator = COMPARISION_OPERATORS[op_token.type]
+
+	def __repr__(self):
+		return f'({self.left_node}, {self.op_token}:NUMBER, {self.right_node})'
+
+
+class stringEqualityNode(equalityNode):
+	__slots__ = ('operator', 'compare_lengths')
+	type = 'stringEqualityNode'
+
+	def __init__(self, left_node, op_token, right_node):
+		super().__init__(left_node, op_token, right_node)
+		self.operator = COMPARISION_OPERATORS[op_token.type]
+		# Strings are ordered by their length but SAMEAS and NOTSAMEAS compare their text
+		self.compare_lengths = op_token.type not in [T_SAMEAS, T_NOTSAMEAS]
+
+	def __repr__(self):
+		return f'({self.left_node}, {self.op_token}:STRING, {self.right_node})'
+
+
+class switchNode(conditionalNode):
+	__slots__ = ('var_name', 'slot', 'value_type', 'table')
+	type = 'switchNode'
+
+	def __init__(self, if_node, elseif_nodes, else_node, var_name, slot, value_type, table):
+		super().__init__(if_node, elseif_nodes, else_node)
+		self.var_name = var_name
+		self.slot = slot
+		# The python types the variable's value must have for the table to be used
+		self.value_type = value_type
+		# Maps each literal to the index of the first arm that compares against it
+		self.table = table
+
+	def armCode(self, arm):
+		if arm is None:
+			return self.else_node.else_code_nodes if self.else_node else []
+		if arm == 0:
+			return self.if_node.if_code_nodes
+		return self.elseif_nodes[arm - 1].elseif_code_nodes
+
+	def __repr__(self):
+		return f'(switch:{self.var_name}, cases:{len(self.table)}, else:{bool(self.else_node)})'
+
+
+def findNodeMethod(handler, prefix, node):
+	# Looks for a method for the node's class, then for each class it inherits from
+	for cls in type(node).__mro__:
+		method = getattr(handler, f'{prefix}{cls.__name__}', None)
+		if method is not None:
+			return method
+	return None
+
+
 ################
 # PARSER
 ################
 
+# How tightly each number operator binds, used by the precedence climbing in Parser.numberOp
+NUMBER_PRECEDENCE = {
+	T_ADD: 1,
+	T_MINUS: 1,
+	T_MULTIPLY: 2,
+	T_DIVIDE: 2,
+}
+
+# Bit flags for what is left in a line before its next code block
+AHEAD_STRING = 1
+AHEAD_JOIN = 2
+AHEAD_EQUALS = 4
+AHEAD_EQUALITY = 8
+AHEAD_LIST = 16
+
+AHEAD_FLAGS = {
+	T_STRING: AHEAD_STRING,
+	T_JOIN: AHEAD_JOIN,
+	T_EQUALS: AHEAD_EQUALS,
+	**{type_: AHEAD_EQUALITY for type_ in COMPARISION_OPERATORS},
+}
+
 class Parser:
-	def __init__(self, tokens):
-		self.tokens = tokens
+	def __init__(self, stream):
+		# One Parser parses the whole program straight from the TokenStream the lexer made. A line is the list of the
+		# indexes of its tokens in the stream along with their types, a Token is only made when a node or error needs one
+		self.stream = stream
+		self.elements = []
+		self.types = []
+		self.tok_idx = -1
+		self.current = None
+		self.current_type = None
+		self.output = False
+		self.slots = VariableSlots()
+
+	@property
+	def current_tok(self):
+		return self.stream.token(self.current)
+
+	def parseProgram(self):
+		# Parses every line, stopping at the first parse error. If the parser raises a ParseError, the stream and where the
+		# unparsed lines start are returned so the caller can parse them again once the lines before them have run
+		program = programNode([], self.slots.names)
+		idx = 0
+		while idx < len(self.stream):
+			try:
+				res = self.parseLine(idx)
+			except ParseError:
+				return program, None, (self.stream, idx)
+			if res.error: return program, res.error, None
+			program.line_nodes.append(res.node)
+			idx = self.elements[-1] + 1
+		return program, None, None
+
+	def parseLine(self, idx):
+		kinds = self.stream.kinds
+		self.elements = self.stream.lineElements(idx)
+		self.types = [TOKEN_KINDS[kinds[element]] for element in self.elements]
 		self.tok_idx = -1
-		self.current_tok = ''
+		self.current = None
+		self.current_type = None
 		self.output = False
+		self.scanLine()
 		self.advance()
+		return self.parse()
+
+	def parseBlock(self):
+		# The lines of the code block at the current token are parsed by this Parser as well, the line the block is in is
+		# put back afterwards
+		if self.current_type != T_BLOCK:
+			raise ParseError(f'Expected a code block, found {self.current_type}')
+
+		line_state = (self.elements, self.types, self.tok_idx, self.current, self.current_type, self.output, self.ahead, self.length_in_line)
+		block = blockNode([])
+		res = ParseResult()
+		idx = self.current + 1
+		end = self.stream.values[self.current]
+		while idx < end:
+			line_res = self.parseLine(idx)
+			if line_res.error:
+				res = line_res
+				break
+			block.line_nodes.append(line_res.node)
+			idx = self.elements[-1] + 1
+
+		self.elements, self.types, self.tok_idx, self.current, self.current_type, self.output, self.ahead, self.length_in_line = line_state
+		if res.error: return res
+		return res.success(block)
+
+	def scanLine(self):
+		# Works out once, going backwards through the line, which kinds of token come after each index and before
+		# the next code block, so deciding how to parse an expression never has to look through the rest of the line
+		flags = 0
+		self.ahead = [0] * (len(self.types) + 1)
+		for idx in range(len(self.types) - 1, -1, -1):
+			type_ = self.types[idx]
+			if type_ == T_BLOCK:
+				flags = AHEAD_LIST
+			elif type_ == T_LSBRACK:
+				flags = 0
+			else:
+				flags |= AHEAD_FLAGS.get(type_, 0)
+			self.ahead[idx] = flags
+
+		# A LENGTH anywhere in the line before its first code block means strings are not parsed with stringOp
+		self.length_in_line = False
+		for type_ in self.types:
+			if type_ == T_BLOCK:
+				self.length_in_line = None
+				break
+			elif type_ == T_LENGTH:
+				self.length_in_line = True
+				break
+			elif type_ == T_LSBRACK:
+				break
 
 	def advance(self):
 		self.tok_idx += 1
-		if self.tok_idx < len(self.tokens):
-			self.current_tok = self.tokens[self.tok_idx]
+		if self.tok_idx < len(self.elements):
+			self.current = self.elements[self.tok_idx]
+			self.current_type = self.types[self.tok_idx]
 
-		return self.current_tok
+		return self.current_type
 
 	def parse(self):
-		if self.tok_idx == 0 and self.tokens[self.tok_idx].type == T_VAR and self.tokens[self.tok_idx + 1].type == T_EQUALS:
+		if self.tok_idx == 0 and self.types[0] == T_VAR and self.types[1] == T_EQUALS:
 			res = self.varAssign()
-		elif self.tokens[0].type == T_IF:
+		elif self.types[0] == T_IF:
 			res = self.buildConditional()
 			if res.error: return ParseResult().failure(res.error)
-			# self.advance()
-			# if self.current_tok.type != T_RSBRACK:
-			# 	return ParseResult().failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Cannot find a closing ]'))
-			# self.advance()
-		elif self.tokens[0].type in [T_ELSE, T_ELSEIF]:
-			if self.tokens[0].type == T_ELSE:
-				return ParseResult().failure(InvalidSyntaxError(self.tokens[0].pos_start, self.tokens[0].pos_start, 'No IF detected before ELSE [E5]'))
-			elif self.tokens[0].type == T_ELSEIF:
+		elif self.types[0] in [T_ELSE, T_ELSEIF]:
+			if self.types[0] == T_ELSE:
+				first_tok = self.stream.token(self.elements[0])
+				return ParseResult().failure(InvalidSyntaxError(first_tok.pos_start, first_tok.pos_start, 'No IF detected before ELSE [E5]'))
+			elif self.types[0] == T_ELSEIF:
 				return ParseResult().failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_start, 'No IF detected before IFELSE [E6]'))
-		elif self.tokens[0].type == T_FOR:
+		elif self.types[0] == T_FOR:
 			res = self.buildForLoop()
 			if res.error: return ParseResult().failure(res.error)
-		elif self.tokens[0].type == T_BREAK:
+		elif self.types[0] == T_BREAK:
 			res = self.getBreakKeyword()
 		else:
-			if self.tokens[0].type == T_OUTPUT:
+			if self.types[0] == T_OUTPUT:
 				self.output = True
-				kword_check, error = self.checkIfEqualsKwordInTokens()
+				kword_check, error = self.lookAhead(AHEAD_EQUALS, 'E12')
 				if error: return ParseResult().failure(error)
 
 				if kword_check:
 					return ParseResult().failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Cannot output an assignment [E7]'))
 				self.advance()
 				
-			eql_check, error = self.checkIfEqualityInTokens()
+			eql_check, error = self.lookAhead(AHEAD_EQUALITY, 'E15')
 			if error: return ParseResult().failure(error)
 
-			strlen_check, error = self.checkIfStringNotLengthInTokens()
+			strlen_check, error = self.inStringContext()
 			if error: return ParseResult().failure(error)
 
 			
@@ -566,90 +1116,59 @@ class Parser:
 			else:
 				res = self.expr()
 
-			if not res.error and self.current_tok.type != T_EOF:
+			if not res.error and self.current_type != T_EOF:
 				return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Invalid syntax [E8]'))
 
 		self.output = False
 		return res
 
-	def checkIfEqualsKwordInTokens(self):
-		equals_found = False
-		for tok in self.tokens[self.tok_idx:]:
-			if isinstance(tok, Token):
-				if tok.type == T_EQUALS:
-					equals_found = True
-				elif tok.type == T_LSBRACK:
-					break
-			else:
-				return None, InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Invalid syntax: list found instead of token [E12]')
-
-		return equals_found, None
+	def lookAhead(self, flag, error_code):
+		flags = self.ahead[min(self.tok_idx, len(self.elements))]
+		if flags & AHEAD_LIST:
+			return None, InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, f'Invalid syntax: list found instead of token [{error_code}]')
+		return bool(flags & flag), None
 
-	def checkIfStringInTokens(self):
-		string_found = False
-		for tok in self.tokens[self.tok_idx:]:
-			if isinstance(tok, Token):
-				if tok.type == T_STRING:
-					string_found = True
-				elif tok.type == T_LSBRACK:
-					break
-			else:
-				return None, InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Invalid syntax: list found instead of token [E13]')
-
-		return string_found, None
-
-	def checkIfStringNotLengthInTokens(self):
-		# string_found = False
-		# for tok in self.tokens[self.tok_idx:]:
-		# 	if tok.type == T_STRING:
-		# 		string_found = True
-		
-		string_check, error = self.checkIfStringInTokens()
+	def inStringContext(self):
+		# Strings are parsed with stringOp when there is one left in the line and the line has no LENGTH in it
+		string_check, error = self.lookAhead(AHEAD_STRING, 'E13')
 		if error: return None, error
 
 		if not string_check:
 			return False, None
 
-		for tok in self.tokens:
-			if isinstance(tok, Token):
-				if tok.type == T_LENGTH:
-					return False, None
-				elif tok.type == T_LSBRACK:
-					break
-			else:
-				return None, InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Invalid syntax: list found instead of token [E14]')
-		return True, None
-
-	def checkIfEqualityInTokens(self):
-		equality_found = False
-		for tok in self.tokens[self.tok_idx:]:
-			if isinstance(tok, Token):
-				if tok.type in [T_LESSTHAN, T_MORETHAN, T_LESSEQUALS, T_MOREEQUALS, T_SAMEAS, T_NOTSAMEAS]:
-					equality_found = True
-				elif tok.type == T_LSBRACK:
-					break
-			else:
-				return None, InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Invalid syntax: list found instead of token [E15]')
-		return equality_found, None
-
-	def checkIfStringOpInTokens(self):
-		stringop_found = False
-		for tok in self.tokens[self.tok_idx:]:
-			if isinstance(tok, Token):
-				if tok.type in [T_JOIN]:
-					stringop_found = True
-				elif tok.type == T_LSBRACK:
-					break
-			else:
-				return None, InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Invalid syntax: list found instead of token [E16]')
-		return stringop_found, None
+		if self.length_in_line is None:
+			return None, InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Invalid syntax: list found instead of token [E14]')
+		return not self.length_in_line, None
 
 	def factor(self):
 		res = ParseResult()
+		# A Token is never needed for a '(', so one is only made for the other kinds of factor
+		if self.current_type == T_LPAREN:
+			res.register(self.advance())
+			stringop_check, error = self.lookAhead(AHEAD_JOIN, 'E16')
+			if error: return res.failure(error)
+
+			strlen_check, error = self.inStringContext()
+			if error: return res.failure(error)
+
+			if stringop_check:
+				expr = res.register(self.stringOp())
+			elif strlen_check:
+				expr = res.register(self.stringOp())
+			else:
+				expr = res.register(self.expr())
+			if res.error: return res
+
+			if self.current_type == T_RPAREN:
+				res.register(self.advance())
+				return res.success(expr)
+			else:
+				return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, "Expected ')' [E9]"))
+
 		tok = self.current_tok
 		if tok.type == T_VAR:
 			res.register(self.advance())
-			n = varNode(tok)
+			n = varNode(tok, self.slots.slot(tok.value))
 			n.output = self.output
 			return res.success(n)
 		elif tok.type == T_STRING:
@@ -678,50 +1197,43 @@ class Parser:
 			n = numberNode(tok)
 			n.output = self.output
 			return res.success(n)
-		elif tok.type == T_LPAREN:
-			res.register(self.advance())
-			stringop_check, error = self.checkIfStringOpInTokens()
-			if error: return res.failure(error)
-
-			strlen_check, error = self.checkIfStringNotLengthInTokens()
-			if error: return res.failure(error)
-
-			if stringop_check:
-				expr = res.register(self.stringOp())
-			elif strlen_check:
-				expr = res.register(self.stringOp())
-			else:
-				expr = res.register(self.expr())
-			if res.error: return res
-			
-			if self.current_tok.type == T_RPAREN:
-				res.register(self.advance())
-				return res.success(expr)
-			else:
-				return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, "Expected ')' [E9]"))
 
 		return res.failure(InvalidSyntaxError(tok.pos_start, tok.pos_end, f'Invalid syntax: Unknown token type found - {tok.type} [E10]'))
 
-	def term(self):
-		return self.binOp(self.factor, [T_MULTIPLY, T_DIVIDE])
-
 	def expr(self, skipEqlCheck=False):
-		eql_check, error = self.checkIfEqualityInTokens()
+		eql_check, error = self.lookAhead(AHEAD_EQUALITY, 'E15')
 		if error: return ParseResult().failure(error)
 
 		if eql_check and not skipEqlCheck:
 			return self.equalityOp()
-		return self.binOp(self.term, [T_ADD, T_MINUS])
+		return self.numberOp()
+
+	def numberOp(self, min_precedence=1):
+		res = ParseResult()
+		left = res.register(self.factor())
+		if res.error: return res
+
+		while NUMBER_PRECEDENCE.get(self.current_type, 0) >= min_precedence:
+			op_tok = self.current_tok
+			res.register(self.advance())
+			# Only operators which bind more tightly are taken into the right side, so operators of the same precedence are left associative
+			right = res.register(self.numberOp(NUMBER_PRECEDENCE[op_tok.type] + 1))
+			if res.error: return res
+
+			left = binOpNode(left, op_tok, right)
+
+		left.output = self.output
+		return res.success(left)
 
 	def varAssign(self):
 		res = ParseResult()
 		var = self.current_tok
 		res.register(self.advance())
-		if self.current_tok.type != T_EQUALS:
+		if self.current_type != T_EQUALS:
 			return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Expected EQUALS [E11]'))
 		else:
 			res.register(self.advance())
-			strlen_check, error = self.checkIfStringNotLengthInTokens()
+			strlen_check, error = self.inStringContext()
 			if error: return res.failure(error)
 
 			if strlen_check:
@@ -731,30 +1243,14 @@ class Parser:
 
 		if res.error: return res
 
-		return res.success(varAssignNode(var, var_val))
-
-	def binOp(self, func, ops):
-		res = ParseResult()
-		left = res.register(func())
-		if res.error: return res
-
-		while self.current_tok.type in ops:
-			op_tok = self.current_tok
-			res.register(self.advance())
-			right = res.register(func())
-			if res.error: return res
-
-			left = binOpNode(left, op_tok, right)
-		
-		left.output = self.output
-		return res.success(left)
+		return res.success(varAssignNode(var, var_val, self.slots.slot(var.value)))
 
 	def stringOp(self):
 		res = ParseResult()
 		left = res.register(self.factor())
 		if res.error: return res
 
-		while self.current_tok.type in [T_JOIN, T_MULTIPLY]:
+		while self.current_type in [T_JOIN, T_MULTIPLY]:
 			op_tok = self.current_tok
 			res.register(self.advance())
 			right = res.register(self.factor())
@@ -762,7 +1258,7 @@ class Parser:
 
 			left = stringOpNode(left, op_tok, right)
 
-		if self.current_tok.type in [T_ADD, T_MINUS, T_DIVIDE]:
+		if self.current_type in [T_ADD, T_MINUS, T_DIVIDE]:
 			return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Cannot ADD, MINUS or DIVIDE with strings [E17]'))
 
 		left.output = self.output
@@ -770,28 +1266,28 @@ class Parser:
 
 	def equalityOp(self):
 		res = ParseResult()
-		strlen_check, error = self.checkIfStringNotLengthInTokens()
+		strlen_check, error = self.inStringContext()
 		if error: return ParseResult().failure(error)
 		if strlen_check:
 			left = res.register(self.stringOp())
 		else:
-			left = res.register(self.expr(skipEqlCheck=True))
+			left = res.register(self.numberOp())
 		if res.error: return res
 
-		while self.current_tok.type in [T_LESSTHAN, T_MORETHAN, T_LESSEQUALS, T_MOREEQUALS, T_SAMEAS, T_NOTSAMEAS]:
+		while self.current_type in COMPARISION_OPERATORS:
 			op_tok = self.current_tok
 			res.register(self.advance())
-			strlen_check, error = self.checkIfStringNotLengthInTokens()
+			strlen_check, error = self.inStringContext()
 			if error: return ParseResult().failure(error)
 			if strlen_check:
 				right = res.register(self.stringOp())
 			else:
-				right = res.register(self.expr(skipEqlCheck=True))
+				right = res.register(self.numberOp())
 			if res.error: return res
 
 			left = equalityNode(left, op_tok, right)
 		else:
-			if self.current_tok.type == T_EQUALS:
+			if self.current_type == T_EQUALS:
 				return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Cannot compare variable assignment [E18]'))
 		
 		left.output = self.output
@@ -805,23 +1301,18 @@ class Parser:
 		if if_comp_node.error: return if_comp_node
 
 		res.register(self.advance())
-		if_code_tokens = self.current_tok
-		if_code_nodes = []
-		for toks in if_code_tokens:
-			p = Parser(toks)
-			node = p.parse()
-			if node.error: return node
-
-			if_code_nodes.append(node.node)
+		if_code_nodes = self.parseBlock()
+		if if_code_nodes.error: return if_code_nodes
+		if_code_nodes = if_code_nodes.node
 
 		if_ast_node = ifNode(if_node, if_comp_node, if_code_nodes)
 		conditional_ast_node = conditionalNode(if_ast_node)
 		res.register(self.advance())
 		res.register(self.advance())
 
-		if self.current_tok.type == T_ELSEIF:
+		if self.current_type == T_ELSEIF:
 			elseif_nodes_list = []
-			while self.current_tok.type == T_ELSEIF:
+			while self.current_type == T_ELSEIF:
 				elseif_ast_node = self.buildElseIfConditional()
 				if elseif_ast_node.error: return elseif_ast_node
 
@@ -834,7 +1325,7 @@ class Parser:
 				if error: return res.failure(error)
 			# go through and get the ast node for the elseif token
 			# check if there are any other elseif tokens by checking the next token :- while current tok is elseif
-		if self.current_tok.type == T_ELSE:
+		if self.current_type == T_ELSE:
 			else_ast_node = self.buildElseConditional()
 			if else_ast_node.error: return else_ast_node
 
@@ -849,14 +1340,9 @@ class Parser:
 		else_node = self.current_tok
 		res.register(self.advance())
 		res.register(self.advance())
-		else_code_tokens = self.current_tok
-		else_code_nodes = []
-		for toks in else_code_tokens:
-			p = Parser(toks)
-			node = p.parse()
-			if node.error: return node
-
-			else_code_nodes.append(node.node)
+		else_code_nodes = self.parseBlock()
+		if else_code_nodes.error: return else_code_nodes
+		else_code_nodes = else_code_nodes.node
 
 		else_ast_node = elseNode(else_node, else_code_nodes)
 		return res.success(else_ast_node)
@@ -869,14 +1355,9 @@ class Parser:
 		if elseif_comp_node.error: return elseif_comp_node
 
 		res.register(self.advance())
-		elseif_code_tokens = self.current_tok
-		elseif_code_nodes = []
-		for toks in elseif_code_tokens:
-			p = Parser(toks)
-			node = p.parse()
-			if node.error: return node
-
-			elseif_code_nodes.append(node.node)
+		elseif_code_nodes = self.parseBlock()
+		if elseif_code_nodes.error: return elseif_code_nodes
+		elseif_code_nodes = elseif_code_nodes.node
 
 		elseif_ast_node = elseifNode(elseif_node, elseif_comp_node, elseif_code_nodes)
 		return res.success(elseif_ast_node)
@@ -884,38 +1365,35 @@ class Parser:
 	def buildForLoop(self):
 		res = ParseResult()
 		res.register(self.advance())
-		if self.current_tok.type != T_VAR:
+		if self.current_type != T_VAR:
 			return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Expected a variable after for loop declaration [E19]'))
-		var_node = varNode(self.current_tok)
+		var_tok = self.current_tok
+		var_node = varNode(var_tok, self.slots.slot(var_tok.value))
 
 		res.register(self.advance())
-		if self.current_tok.type != T_FROM:
+		if self.current_type != T_FROM:
 			return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Expected a FROM keyword in loop declaration [E20]'))
 		res.register(self.advance())
 
-		# if self.current_tok.type != T_INT:
+		# if self.current_type != T_INT:
 		# 	return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Expected an integer after the FROM keyword in loop declaration [E21]'))
 		# from_node = numberNode(self.current_tok)
 		# res.register(self.advance())
 		from_node = self.expr()
 
-		if self.current_tok.type != T_TO:
+		if self.current_type != T_TO:
 			return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Expected a TO keyword in loop declaration [E22]'))
 		res.register(self.advance())
 
-		# if self.current_tok.type != T_INT:
+		# if self.current_type != T_INT:
 		# 	return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'Expected an integer after the TO keyword in loop declaration [E23]'))
 		to_node = self.expr()
 		# res.register(self.advance())
 		
 		res.register(self.advance())
-		code_nodes = []
-		for toks in self.current_tok:
-			p = Parser(toks)
-			node = p.parse()
-			if node.error: return node
-
-			code_nodes.append(node.node)
+		code_nodes = self.parseBlock()
+		if code_nodes.error: return code_nodes
+		code_nodes = code_nodes.node
 
 		for_node = forNode(var_node, from_node, to_node, code_nodes)
 		return res.success(for_node)
@@ -924,7 +1402,7 @@ class Parser:
 		res = ParseResult()
 		break_tok = self.current_tok
 		res.register(self.advance())
-		if self.current_tok.type != T_EOF:
+		if self.current_type != T_EOF:
 			return res.failure(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, 'BREAK statement needs to be on its own line [E24]'))
 		
 		break_node = breakNode(break_tok)
@@ -932,6 +1410,8 @@ class Parser:
 
 
 class ParseResult:
+	__slots__ = ('error', 'node')
+
 	def __init__(self):
 		self.error = None
 		self.node = None
@@ -954,402 +1434,2638 @@ class ParseResult:
 		return f'(ParseResult: {self.node})'
 
 ################
-# TYPE CLASSES
+# VALUES
 ################
 
-class Number:
-	def __init__(self, value):
-		self.value = value
-		self.setPos()
+# Values are plain python ints, floats, strs and bools, nothing is allocated for a literal or a saved variable and the
+# same value can be held by any number of variables. Values have no positions, an error points at the nodes involved
+
+NUMBER_VALUES = (int, float)
+
+TYPE_NAMES = {
+	int: 'Number',
+	float: 'Number',
+	str: 'String',
+	bool: 'Boolean',
+}
+
+def typeName(value):
+	return TYPE_NAMES[type(value)]
+
+def binaryOperation(node, left, right):
+	if type(left) == bool or type(right) == bool:
+		raise ExecutionError(RunTimeError(node.pos_start, node.pos_end, 'Cannot perform binary operations on Boolean values'))
+
+	op_tok_type = node.op_token.type
+	if type(left) in NUMBER_VALUES and type(right) in NUMBER_VALUES:
+		if op_tok_type == T_DIVIDE and right == 0:
+			raise ExecutionError(RunTimeError(node.right_node.pos_start, node.right_node.pos_end, 'Division by zero'))
+		return NUMBER_OPERATORS[op_tok_type](left, right)
+	if type(left) == str and op_tok_type == T_MULTIPLY and type(right) in NUMBER_VALUES:
+		return left * right
+	raise TypeError(f'Cannot use {op_tok_type} on {typeName(left)} and {typeName(right)}')
+
+def stringOperation(node, left, right):
+	if node.op_token.type == T_JOIN:
+		if type(left) != str:
+			raise TypeError(f'Cannot join onto {typeName(left)}')
+		if type(right) != str:
+			raise ExecutionError(RunTimeError(node.left_node.pos_start, node.right_node.pos_end, 'You can only join strings together'))
+		return left + right
+
+	# Either side can be the number of times to repeat the other
+	if type(left) in NUMBER_VALUES:
+		left, right = right, left
+	if type(right) not in NUMBER_VALUES or type(left) not in (str, int, float):
+		raise TypeError(f'Cannot multiply {typeName(left)} by {typeName(right)}')
+	return left * right
+
+def compareValues(node, left, right):
+	if typeName(left) != typeName(right):
+		raise ExecutionError(RunTimeError(node.left_node.pos_start, node.right_node.pos_end, f'Cannot compare {typeName(left)} and {typeName(right)}'))
+
+	op_tok_type = node.op_token.type
+	if type(left) == str and op_tok_type not in [T_SAMEAS, T_NOTSAMEAS]:
+		# Strings are ordered by their length
+		left = len(left)
+		right = len(right)
+	return COMPARISION_OPERATORS[op_tok_type](left, right)
+
+def unaryOperation(node, value):
+	if node.op_token.type != T_MINUS:
+		return value
+	if type(value) not in (int, float, str):
+		raise TypeError(f'Cannot negate {typeName(value)}')
+	# Negating a string multiplies it by -1, which gives an empty string
+	return value * -1
+
+
+class BreakValue:
+	# What a BREAK statement gives back, so a loop can tell it apart from a string saying 'break'
+	__slots__ = ()
 
-	def setPos(self, pos_start=None, pos_end=None):
-		self.pos_start = pos_start
-		self.pos_end = pos_end
-		return self
+	def __repr__(self):
+		return 'break'
 
-	def addedTo(self, other):
-		if isinstance(other, Number):
-			return Number(self.value + other.value), None
+BREAK = BreakValue()
 
-	def minusTo(self, other):
-		if isinstance(other, Number):
-			return Number(self.value - other.value), None
+################
+# INTERPRETER
+################
 
-	def multipliedTo(self, other):
-		if isinstance(other, Number):
-			return Number(self.value * other.value), None
+class Interpreter:
+	# Node class -> function which visits it. Filled in the first time each class of node is visited, so visit is a
+	# single dictionary lookup after that. Every subclass of Interpreter gets its own since it can override visit_ methods
+	visitors = {}
+	# Node class -> function added with registerVisitor, used instead of a visit_ method for the same class
+	registered_visitors = {}
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls.visitors = {}
+
+	@classmethod
+	def registerVisitor(cls, node_class, function):
+		# Lets node classes which are not in this file be run by the Interpreter. function is called with the Interpreter
+		# and the node and returns the same as a visit_ method. Subclasses of node_class use it too unless they have their own
+		cls.registered_visitors = {**cls.registered_visitors, node_class: function}
+		classes = [cls]
+		while classes:
+			interpreter_class = classes.pop()
+			interpreter_class.visitors.clear()
+			classes.extend(interpreter_class.__subclasses__())
+
+	@classmethod
+	def findVisitor(cls, node_class):
+		# Looks for a registered function or visit_ method for the node's class, then for each class it inherits from
+		for base in node_class.__mro__:
+			visitor = cls.registered_visitors.get(base) or getattr(cls, f'visit_{base.__name__}', None)
+			if visitor is not None:
+				break
+		else:
+			visitor = cls.noVisitMethod
 
-	def dividedTo(self, other):
-		if isinstance(other, Number):
-			if other.value == 0:
-				return None, RunTimeError(other.pos_start, other.pos_end, 'Division by zero')
-			return Number(self.value / other.value), None
+		cls.visitors[node_class] = visitor
+		return visitor
 
-	def __repr__(self):
-		return f'{self.value}'
+	def __init__(self, debug=False, tiering=True, tier_threshold=None, context=None, values=None):
+		self.context = DEFAULT_CONTEXT if context is None else context
+		self.debug = debug
+		self.tiering = tiering
+		self.tier_threshold = TIER_THRESHOLD if tier_threshold is None else tier_threshold
+		self.loop_counts = {}
+		self.promoted_loops = {}
+		self.invariant_values = {}
+		# The frame of the program being run (see Variables.frame), variables are read and written through the slots
+		# their nodes were given
+		self.values = [] if values is None else values
+		self.output = self.context.output
+		self.write = self.output.write
+
+	def execute(self, node):
+		# Runs a top level statement, the visit_ methods return plain values and raise an ExecutionError when something goes
+		# wrong, this turns that back into a RunTimeResult and the output flag
+		try:
+			value = self.visit(node)
+		except ExecutionError as e:
+			return RunTimeResult().failure(e.error), None
+
+		if value is None:
+			return None, None
+		return RunTimeResult().success(value), statementOutput(node)
 
+	def visit(self, node):
+		visitor = self.visitors.get(type(node))
+		if visitor is None:
+			visitor = self.findVisitor(type(node))
+		return visitor(self, node)
 
-class String:
-	def __init__(self, value):
-		self.value = str(value)
-		self.setPos()
+	def noVisitMethod(self, node):
+		raise Exception(f'No visit_{type(node).__name__} method defined')
 
-	def setPos(self, pos_start=None, pos_end=None):
-		self.pos_start = pos_start
-		self.pos_end = pos_end
-		return self
+	def visitOperands(self, node):
+		try:
+			left = self.visit(node.left_node)
+		except ExecutionError:
+			# The right operand is still visited, and an error from it replaces the one from the left
+			self.visit(node.right_node)
+			raise
+		return left, self.visit(node.right_node)
+
+	def visitBlock(self, code_nodes):
+		# Runs the lines of a code block and returns the value of the last one
+		result = None
+		for line in code_nodes:
+			result = self.visit(line)
+			if result is not None and (statementOutput(line) or self.debug):
+				self.write(result)
+		return result
 
-	def joinedTo(self, other):
-		if isinstance(other, String):
-			return String(self.value + other.value), None
-		return None, RunTimeError(self.pos_start, other.pos_end, 'You can only join strings together')
-	
-	def multipliedTo(self, other):
-		if isinstance(other, Number):
-			return String(self.value * other.value), None
+	def visit_numberNode(self, node):
+		return node.token.value
 
-	def lengthOf(self):
-		return Number(len(self.value)), None
+	def visit_binOpNode(self, node):
+		left, right = self.visitOperands(node)
+		return binaryOperation(node, left, right)
 
-	def __repr__(self):
-		return f'{self.value}'
+	def visit_unaryOpNode(self, node):
+		return unaryOperation(node, self.visit(node.node))
 
+	def visit_varAssignNode(self, node):
+		try:
+			val = self.visit(node.node)
+		except ExecutionError:
+			self.values[node.slot] = None
+			raise
+		self.values[node.slot] = val
+		return val
 
-class Boolean:
-	def __init__(self, value):
-		self.value = bool(value)
-		self.setPos()
+	def visit_varNode(self, node):
+		value = self.values[node.slot]
+		if value is None:
+			raise ExecutionError(RunTimeError(node.pos_start, node.pos_end, f'No variable with name {node.node.value} defined'))
+		return value
 
-	def setPos(self, pos_start=None, pos_end=None):
-		self.pos_start = pos_start
-		self.pos_end = pos_end
-		return self
+	def visit_stringNode(self, node):
+		return node.token.value
 
-	def __repr__(self):
-		return self.value
+	def visit_booleanNode(self, node):
+		return node.token.value
 
+	def visit_stringLengthNode(self, node):
+		return len(self.visit(node.token))
 
-class Comparision:
-	def __init__(self, left_node, op_token, right_node):
-		self.left = left_node
-		self.op_tok = op_token
-		self.right = right_node
+	def visit_stringOpNode(self, node):
+		left, right = self.visitOperands(node)
+		return stringOperation(node, left, right)
 
-	def checkNodeCompatibility(self):
-		if type(self.left) != type(self.right):
-			return False
-		else:
-			return True
+	def visit_equalityNode(self, node):
+		left, right = self.visitOperands(node)
+		return compareValues(node, left, right)
 
-	def compare(self):
-		op = self.op_tok.type
-		left = self.left.value
-		right = self.right.value
+	def visit_numberBinOpNode(self, node):
+		left, right = self.visitOperands(node)
 
-		if not self.checkNodeCompatibility():
-			return None, RunTimeError(self.left.pos_start, self.right.pos_end, f'Cannot compare {type(self.left).__name__} and {type(self.right).__name__}')
+		if node.op_token.type == T_DIVIDE and right == 0:
+			raise ExecutionError(RunTimeError(node.right_node.pos_start, node.right_node.pos_end, 'Division by zero'))
 
-		if type(left) == str and type(right) == str:
-			left = len(left)
-			right = len(right)
-		
-		if op == T_LESSTHAN:
-			return Boolean(left < right), None
-		elif op == T_MORETHAN:
-			return Boolean(left > right), None
-		elif op == T_LESSEQUALS:
-			return Boolean(left <= right), None
-		elif op == T_MOREEQUALS:
-			return Boolean(left >= right), None
-		elif op == T_SAMEAS:
-			return Boolean(self.left.value == self.right.value), None
-		elif op == T_NOTSAMEAS:
-			return Boolean(self.left.value != self.right.value), None
-		else:
-			return None, RunTimeError(self.op_tok.pos_start, self.op_tok.pos_end, 'Unknown comparision operator')
+		return node.operator(left, right)
 
-################
-# INTERPRETER
-################
+	def visit_numberNegateNode(self, node):
+		return self.visit(node.node) * -1
 
-class Interpreter:
-	def __init__(self, debug=False):
-		self.debug = debug
+	def visit_stringJoinNode(self, node):
+		left, right = self.visitOperands(node)
+		return left + right
 
-	def visit(self, node):
-		method_name = f'visit_{type(node).__name__}'
-		method = getattr(self, method_name, self.noVisitMethod)
-		result = method(node)
+	def visit_stringRepeatNode(self, node):
+		left, right = self.visitOperands(node)
+		return left * right
 
-		return result
-		
-	def noVisitMethod(self, node):
-		raise Exception(f'No visit_{type(node).__name__} method defined')
+	def visit_numberEqualityNode(self, node):
+		left, right = self.visitOperands(node)
+		return node.operator(left, right)
 
-	def visit_numberNode(self, node):
-		return RunTimeResult().success(Number(node.token.value).setPos(node.pos_start, node.pos_end)), node.output
+	def visit_stringEqualityNode(self, node):
+		left, right = self.visitOperands(node)
 
-	def visit_binOpNode(self, node, addToVarsSaved=False):
-		res = RunTimeResult()
-		left = res.register(self.visit(node.left_node))
-		right = res.register(self.visit(node.right_node))
-		op_tok_type = node.op_token.type
+		if node.compare_lengths:
+			return node.operator(len(left), len(right))
+		return node.operator(left, right)
 
-		if res.error: return res, None
+	def visit_conditionalNode(self, node):
+		if self.visit(node.if_node.if_comp_node.node):
+			return self.visitBlock(node.if_node.if_code_nodes)
 
-		if type(left) == Boolean or type(right) == Boolean:
-			return res.failure(RunTimeError(node.pos_start, node.pos_end, 'Cannot perform binary operations on Boolean values')), None
+		# whichever comp_node comes up as being True first, do code of that node
+		for elseif_node in node.elseif_nodes:
+			if self.visit(elseif_node.elseif_comp_node.node):
+				return self.visitBlock(elseif_node.elseif_code_nodes)
 
-		if op_tok_type == T_ADD:
-			result, error = left.addedTo(right)
-		if op_tok_type == T_MINUS:
-			result, error = left.minusTo(right)
-		if op_tok_type == T_MULTIPLY:
-			result, error = left.multipliedTo(right)
-		if op_tok_type == T_DIVIDE:
-			result, error = left.dividedTo(right)
+		if node.else_node:
+			return self.visitBlock(node.else_node.else_code_nodes)
+		return None
+	
+	def visit_switchNode(self, node):
+		value = self.values[node.slot]
+		if type(value) not in node.value_type:
+			# The comparisions would fail, so let the if-else statement run them and report the error
+			return self.visit_conditionalNode(node)
 
-		# right is Number object
-		# result is Number object
+		return self.visitBlock(node.armCode(node.table.get(value)))
 
-		if error:
-			return res.failure(error), None
+	def visitBound(self, node):
+		# Errors in the bounds of a FOR loop are ignored and the loop carries on with None
+		try:
+			return self.visit(node)
+		except ExecutionError:
+			return None
 
-		return res.success(result.setPos(node.pos_start, node.pos_end)), node.output
+	def visit_forNode(self, node):
+		result = None
+		for invariant in node.invariant_nodes:
+			self.invariant_values.pop(invariant, None)
+		values = self.values
+		slot = node.var_node.slot
+		from_val = self.visitBound(node.from_node.node)
+		to_val = self.visitBound(node.to_node.node)
+		iterations = range(from_val, to_val)
+		values[slot] = from_val
+		break_loop = False
+		compiled_lines = self.promoted_loops.get(node)
 
-	def visit_unaryOpNode(self, node):
-		res = RunTimeResult()
-		number = res.register(self.visit(node.node))
-		if res.error: return res, None
+		for i in iterations:
+			if break_loop:
+				break
 
-		error = None
-		if node.op_token.type == T_MINUS:
-			number, error = number.multipliedTo(Number(-1))
+			if compiled_lines is None and self.tiering:
+				self.loop_counts[node] = self.loop_counts.get(node, 0) + 1
+				if self.loop_counts[node] > self.tier_threshold:
+					compiled_lines = self.promoteLoop(node)
 
-		if error:
-			return res.failure(error), None
+			if compiled_lines is not None:
+				result, break_loop = self.runCompiledIteration(compiled_lines)
+			else:
+				for line in node.code_nodes:
+					result = self.visit(line)
+					if result is not None:
+						if result is BREAK:
+							self.output.flush()
+							break_loop = True
+							break
+
+						if statementOutput(line) or self.debug:
+							self.write(result)
+				
+			# The variable is given a new value rather than changing the one it holds, which other variables can share
+			values[slot] += 1
 
-		return res.success(number.setPos(node.pos_start, node.pos_end)), node.output
+		return result
 
-	def visit_varAssignNode(self, node):
-		res = RunTimeResult()
-		if res.error: return res, None
+	def promoteLoop(self, node):
+		# The loop is hot, compile its body once and run the rest of its iterations through the closures
+		compiler = ClosureCompiler(debug=self.debug, context=self.context)
+		compiled_lines = [(compiler.compile(line), statementOutput(line) or self.debug) for line in node.code_nodes]
+		self.promoted_loops[node] = compiled_lines
+
+		if self.debug:
+			self.write(f'Promoted FOR loop on line {node.var_node.pos_start.ln + 1} after {self.loop_counts[node]} iterations')
+		return compiled_lines
+
+	def runCompiledIteration(self, compiled_lines):
+		value = None
+		values, sink, invariant_values = self.values, self.output, self.invariant_values
+		for closure, output in compiled_lines:
+			value = closure(values, sink, invariant_values)
+			if value is not None:
+				if value is BREAK:
+					self.output.flush()
+					return value, True
+				if output:
+					self.write(value)
+		return value, False
 
-		expr = node.node
+	def visit_breakNode(self, node):
+		return BREAK
 
-		val = res.register(self.visit(expr))
-		VARS_SAVED[node.varNode.value] = val
-		return res.success(val), node.output
+	def visit_invariantNode(self, node):
+		value = self.invariant_values.get(node)
+		if value is None:
+			value = self.visit(node.node)
+			self.invariant_values[node] = value
+		return value
 
-	def visit_varNode(self, node):
-		res = RunTimeResult()
-		if node.node.value in VARS_SAVED:
-			result = VARS_SAVED[node.node.value]
-			return res.success(result.setPos(node.pos_start, node.pos_end)), node.output
-		else:
-			return res.failure(RunTimeError(node.pos_start, node.pos_end, f'No variable with name {node.node.value} defined')), None
 
-	def visit_stringNode(self, node):
-		return RunTimeResult().success(String(node.token.value).setPos(node.pos_start, node.pos_end)), node.output
+class RunTimeResult:
+	def __init__(self):
+		self.value = None
+		self.error = None
 
-	def visit_stringLengthNode(self, node):
-		res = RunTimeResult()
-		string = res.register(self.visit(node.token))
-		if res.error: return res, None
+	def success(self, value):
+		self.value = value
+		return self
 
-		result, error = string.lengthOf()
-		if error:
-			return res.failure(error), None
-		return res.success(result), node.output
+	def failure(self, error):
+		self.error = error
+		return self
 
-	def visit_stringOpNode(self, node):
-		res = RunTimeResult()
-		left = res.register(self.visit(node.left_node))
-		right = res.register(self.visit(node.right_node))
-		op_tok_type = node.op_token.type
+	def __repr__(self):
+		return f'(RunTimeResult: {self.value}, {self.error})'
 
-		if res.error: return res, None
+################
+# OPTIMIZER
+################
 
-		if op_tok_type == T_JOIN:
-			result, error = left.joinedTo(right)
-		if op_tok_type == T_MULTIPLY:
-			if isinstance(left, Number):
-				result, error = right.multipliedTo(left)
+# Folded strings longer than this are left to be built at run time
+FOLD_STRING_LIMIT = 1000
+
+# IF-ELSEIF chains with at least this many arms comparing one variable to literals become a switchNode
+SWITCH_MIN_ARMS = 4
+
+def iterNodes(node):
+	# Yields the node and every node nested inside it, including the lines of any code blocks
+	if node is None:
+		return
+	yield node
+	if isinstance(node, (binOpNode, stringOpNode, equalityNode)):
+		yield from iterNodes(node.left_node)
+		yield from iterNodes(node.right_node)
+	elif isinstance(node, (unaryOpNode, varAssignNode, invariantNode)):
+		yield from iterNodes(node.node)
+	elif isinstance(node, stringLengthNode):
+		yield from iterNodes(node.token)
+	elif isinstance(node, conditionalNode):
+		arms = [(node.if_node.if_comp_node, node.if_node.if_code_nodes)]
+		arms += [(elseif_node.elseif_comp_node, elseif_node.elseif_code_nodes) for elseif_node in node.elseif_nodes]
+		if node.else_node:
+			arms.append((None, node.else_node.else_code_nodes))
+		for comp_node, code_nodes in arms:
+			if comp_node:
+				yield from iterNodes(comp_node.node)
+			for line in code_nodes:
+				yield from iterNodes(line)
+	elif isinstance(node, blockNode):
+		for line in node:
+			yield from iterNodes(line)
+	elif isinstance(node, forNode):
+		yield from iterNodes(node.var_node)
+		yield from iterNodes(node.from_node.node)
+		yield from iterNodes(node.to_node.node)
+		for line in node.code_nodes:
+			yield from iterNodes(line)
+
+
+# Expressions which only read variables and never change them, so they can be cached while none of their variables change
+PURE_NODES = (numberNode, stringNode, booleanNode, varNode, binOpNode, unaryOpNode, stringLengthNode, stringOpNode, equalityNode)
+
+def passThroughVar(node):
+	# The name of the variable whose saved value the expression returns as it is (x or +x), otherwise None
+	if isinstance(node, varNode):
+		return node.node.value
+	if isinstance(node, unaryOpNode) and node.op_token.type != T_MINUS:
+		return passThroughVar(node.node)
+	return None
+
+class Optimizer:
+	# -O1 folds constant expressions, prunes constant IF branches and swaps in type specialised nodes
+	# -O2 also drops assignments to variables the program never reads
+	def __init__(self, level=1, program=None, var_types=()):
+		self.level = level
+		self.types = TypeInference(program, var_types) if level >= 1 else None
+		self.read_vars = set()
+		for statement in program or []:
+			for node in iterNodes(statement):
+				if isinstance(node, varNode):
+					self.read_vars.add(node.node.value)
+				elif isinstance(node, forNode):
+					# The loop increments whatever the variable holds, so stores to it always matter
+					self.read_vars.add(node.var_node.node.value)
+
+	def optimizeStatement(self, node):
+		# Returns the optimized statement, or None if the whole statement can be dropped
+		if self.level < 1:
+			return node
+		if self.isDeadStore(node):
+			return None
+		return self.hoistInvariants(self.optimize(node))
+
+	def optimizeProgram(self, program):
+		return programNode([node for node in map(self.optimizeStatement, program) if node is not None], program.names)
+
+	def optimize(self, node):
+		method = getattr(self, f'optimize_{type(node).__name__}', None)
+		if method is None:
+			return node
+		return method(node)
+
+	def optimizeBlock(self, code_nodes):
+		lines = []
+		for idx, line in enumerate(code_nodes):
+			# The last line of a block is its result, so it stays even if it is a dead store
+			if idx < len(code_nodes) - 1 and self.isDeadStore(line):
+				continue
+			lines.append(self.optimize(line))
+		return blockNode(lines)
+
+	def isDeadStore(self, node):
+		if self.level < 2 or not isinstance(node, varAssignNode):
+			return False
+		if node.varNode.value in self.read_vars:
+			return False
+		return isinstance(self.optimize(node.node), (numberNode, stringNode, booleanNode))
+
+	def isConstant(self, node):
+		if isinstance(node, (numberNode, stringNode, booleanNode)):
+			return True
+		return isinstance(node, stringLengthNode) and self.isConstant(node.token)
+
+	def fold(self, node):
+		# Evaluates a constant expression once, leaving it alone if it errors so the error still happens at run time
+		try:
+			if self.foldSize(node) > FOLD_STRING_LIMIT:
+				return node
+			value = Interpreter().visit(node)
+		except Exception:
+			return node
+
+		# A bool is also an int, so it is checked for first
+		if type(value) == bool:
+			folded = booleanNode(Token(T_BOOLEAN, value, node.pos_start, node.pos_end))
+		elif type(value) in NUMBER_VALUES:
+			if type(value) == float and not math.isfinite(value):
+				return node
+			tok_type = T_INT if type(value) == int else T_FLOAT
+			folded = numberNode(Token(tok_type, value, node.pos_start, node.pos_end))
+		elif type(value) == str and len(value) <= FOLD_STRING_LIMIT:
+			folded = stringNode(Token(T_STRING, value, node.pos_start, node.pos_end))
+		else:
+			return node
+		folded.output = node.output
+		return folded
+
+	def foldSize(self, node):
+		# How long a string the expression would build, worked out from its operands so a huge one is never built
+		if not isinstance(node, (binOpNode, stringOpNode)):
+			return 0
+		values = [Interpreter().visit(node.left_node), Interpreter().visit(node.right_node)]
+		strings = [len(value) for value in values if type(value) == str]
+		if not strings:
+			return 0
+		if node.op_token.type == T_JOIN:
+			return sum(strings)
+		counts = [value for value in values if type(value) in NUMBER_VALUES]
+		return strings[0] * max(counts[0], 0) if counts else 0
+
+	def optimizeOperator(self, node):
+		left = self.optimize(node.left_node)
+		right = self.optimize(node.right_node)
+		new_node = type(node)(left, node.op_token, right)
+		new_node.output = node.output
+		if self.isConstant(left) and self.isConstant(right):
+			new_node = self.fold(new_node)
+		return self.types.specialize(new_node)
+
+	def optimize_binOpNode(self, node):
+		return self.optimizeOperator(node)
+
+	def optimize_stringOpNode(self, node):
+		return self.optimizeOperator(node)
+
+	def optimize_equalityNode(self, node):
+		return self.optimizeOperator(node)
+
+	def optimize_unaryOpNode(self, node):
+		new_node = unaryOpNode(node.op_token, self.optimize(node.node))
+		new_node.output = node.output
+		if self.isConstant(new_node.node):
+			new_node = self.fold(new_node)
+		return self.types.specialize(new_node)
+
+	def optimize_stringLengthNode(self, node):
+		new_node = stringLengthNode(self.optimize(node.token))
+		new_node.output = node.output
+		if self.isConstant(new_node.token):
+			new_node = self.fold(new_node)
+		return new_node
+
+	def optimize_varAssignNode(self, node):
+		new_node = varAssignNode(node.varNode, self.optimize(node.node), node.slot)
+		new_node.output = node.output
+		return new_node
+
+	def optimizeParseResult(self, comp_node):
+		res = ParseResult()
+		res.error = comp_node.error
+		return res.success(self.optimize(comp_node.node))
+
+	def constantTruth(self, comp_node):
+		# True or False for a condition that always has the same value, None otherwise
+		if not self.isConstant(comp_node.node):
+			return None
+		try:
+			result = Interpreter().visit(comp_node.node)
+		except Exception:
+			return None
+		return bool(result)
+
+	def optimize_conditionalNode(self, node):
+		arms = [(node.if_node.if_node, node.if_node.if_comp_node, node.if_node.if_code_nodes)]
+		arms += [(elseif_node.elseif_node, elseif_node.elseif_comp_node, elseif_node.elseif_code_nodes) for elseif_node in node.elseif_nodes]
+		else_arm = None
+		if node.else_node:
+			else_true = booleanNode(Token(T_BOOLEAN, True, node.else_node.else_node.pos_start, node.else_node.else_node.pos_end))
+			else_arm = (node.else_node.else_node, ParseResult().success(else_true), node.else_node.else_code_nodes)
+
+		kept = []
+		for tok, comp_node, code_nodes in arms:
+			comp_node = self.optimizeParseResult(comp_node)
+			truth = self.constantTruth(comp_node)
+			if truth is False:
+				continue
+			if truth is True:
+				# Nothing after an always true branch can run
+				else_arm = (tok, comp_node, code_nodes)
+				break
+			kept.append((tok, comp_node, self.optimizeBlock(code_nodes)))
+
+		if not kept:
+			if else_arm is None:
+				# No branch can ever run, keep the first condition so the statement still does nothing
+				tok, comp_node, code_nodes = arms[0]
+				return conditionalNode(ifNode(tok, self.optimizeParseResult(comp_node), code_nodes))
+			tok, comp_node, code_nodes = else_arm
+			return conditionalNode(ifNode(tok, comp_node, self.optimizeBlock(code_nodes)))
+
+		tok, comp_node, code_nodes = kept[0]
+		new_node = conditionalNode(ifNode(tok, comp_node, code_nodes))
+		for tok, comp_node, code_nodes in kept[1:]:
+			new_node.addNode(elseifNode(tok, comp_node, code_nodes))
+		if else_arm:
+			new_node.addNode(elseNode(else_arm[0], self.optimizeBlock(else_arm[2])))
+		return self.makeSwitch(new_node)
+
+	def makeSwitch(self, node):
+		# Turns a chain of x SAMEAS <literal> arms into a switchNode, or returns the node as it is
+		comp_nodes = [node.if_node.if_comp_node.node] + [elseif_node.elseif_comp_node.node for elseif_node in node.elseif_nodes]
+		if len(comp_nodes) < SWITCH_MIN_ARMS:
+			return node
+
+		var_name = None
+		value_type = None
+		table = {}
+		for arm, comp_node in enumerate(comp_nodes):
+			if not isinstance(comp_node, equalityNode) or comp_node.op_token.type != T_SAMEAS:
+				return node
+			if not isinstance(comp_node.left_node, varNode):
+				return node
+
+			literal = comp_node.right_node
+			if isinstance(literal, numberNode):
+				literal_type = NUMBER_VALUES
+			elif isinstance(literal, stringNode):
+				literal_type = (str,)
 			else:
-				result, error = left.multipliedTo(right)
+				return node
+
+			name = comp_node.left_node.node.value
+			if var_name is None:
+				var_name = name
+				slot = comp_node.left_node.slot
+				value_type = literal_type
+			elif name != var_name or literal_type != value_type:
+				return node
+
+			table.setdefault(literal.token.value, arm)
+
+		return switchNode(node.if_node, node.elseif_nodes, node.else_node, var_name, slot, value_type, table)
+
+	def optimize_forNode(self, node):
+		from_node = self.optimizeParseResult(node.from_node)
+		to_node = self.optimizeParseResult(node.to_node)
+		return forNode(node.var_node, from_node, to_node, self.optimizeBlock(node.code_nodes))
+
+	# Loop invariant code motion. An expression in a FOR loop which does not read any variable assigned in the loop is
+	# wrapped in an invariantNode, the first time it is evaluated after the loop starts its value is cached and every
+	# other iteration gets that value. Nothing is evaluated before it would have been, so errors still
+	# happen at the same point
+
+	def hoistInvariants(self, node):
+		if isinstance(node, forNode):
+			return self.hoistLoop(node)
+		if isinstance(node, conditionalNode):
+			return self.mapConditional(node, lambda comp: comp, self.hoistInvariants)
+		return node
+
+	def mapConditional(self, node, comp_fn, line_fn):
+		def mapComparision(comp_node):
+			res = ParseResult()
+			res.error = comp_node.error
+			return res.success(comp_fn(comp_node.node))
+
+		# Copied so that a switchNode keeps its table
+		new_node = copy.copy(node)
+		if_node = node.if_node
+		new_node.if_node = ifNode(if_node.if_node, mapComparision(if_node.if_comp_node), blockNode([line_fn(line) for line in if_node.if_code_nodes]))
+		new_node.elseif_nodes = [elseifNode(elseif_node.elseif_node, mapComparision(elseif_node.elseif_comp_node), blockNode([line_fn(line) for line in elseif_node.elseif_code_nodes])) for elseif_node in node.elseif_nodes]
+		if node.else_node:
+			new_node.else_node = elseNode(node.else_node.else_node, blockNode([line_fn(line) for line in node.else_node.else_code_nodes]))
+		return new_node
+
+	def hoistLoop(self, node):
+		modified = {}
+		self.modifiedVars(node, modified)
+		return self.hoistNestedLoop(node, [], modified)
+
+	def modifiedVars(self, node, modified):
+		# Returns the variables a line assigns, and stores the ones each FOR loop in it assigns under the id of the loop
+		if isinstance(node, varAssignNode):
+			return {node.varNode.value}
+		names = set()
+		if isinstance(node, conditionalNode):
+			code_nodes = list(node.if_node.if_code_nodes)
+			for elseif_node in node.elseif_nodes:
+				code_nodes += elseif_node.elseif_code_nodes
+			if node.else_node:
+				code_nodes += node.else_node.else_code_nodes
+			for line in code_nodes:
+				names |= self.modifiedVars(line, modified)
+		elif isinstance(node, forNode):
+			names.add(node.var_node.node.value)
+			for line in node.code_nodes:
+				names |= self.modifiedVars(line, modified)
+			modified[id(node)] = names
+		return names
+
+	def hoistNestedLoop(self, node, loops, modified):
+		# loops has the variables each loop around this line changes and its invariant_nodes, outermost first
+		new_node = copy.copy(node)
+		new_node.invariant_nodes = []
+		loops.append((modified[id(node)], new_node.invariant_nodes))
+		new_node.code_nodes = blockNode([self.hoistLine(line, loops, modified) for line in node.code_nodes])
+		loops.pop()
+		return new_node
+
+	def hoistLine(self, node, loops, modified):
+		if isinstance(node, varAssignNode):
+			new_node = copy.copy(node)
+			new_node.node = self.hoistOut(node.node, loops)
+			return new_node
+		if isinstance(node, conditionalNode):
+			return self.mapConditional(node, lambda comp: self.hoistOut(comp, loops), lambda line: self.hoistLine(line, loops, modified))
+		if isinstance(node, forNode):
+			# The bounds of an inner loop can only be hoisted out of the loops around it, its body out of it as well
+			from_node = self.hoistOut(node.from_node.node, loops)
+			to_node = self.hoistOut(node.to_node.node, loops)
+			new_node = self.hoistNestedLoop(node, loops, modified)
+			new_node.from_node = ParseResult().success(from_node)
+			new_node.to_node = ParseResult().success(to_node)
+			return new_node
+		if isinstance(node, breakNode):
+			return node
+		return self.hoistOut(node, loops)
+
+	def hoistOut(self, node, loops):
+		new_node, names, hoisted = self.hoistExpr(node, loops, len(loops))
+		for level, invariant in hoisted:
+			loops[level][1].append(invariant)
+		return new_node
+
+	def invariantLevel(self, names, loops, limit):
+		# Each loop changes everything the loops inside it change, so the outermost loop which changes none of the names
+		# can be found with a binary search
+		low, high = 0, limit
+		while low < high:
+			middle = (low + high) // 2
+			if names.isdisjoint(loops[middle][0]):
+				high = middle
+			else:
+				low = middle + 1
+		return low if low < limit else None
+
+	def hoistExpr(self, node, loops, limit):
+		# Returns the new node, the variables it reads (None if it is not pure) and the (loop level, invariantNode) pairs
+		# hoisted out of it. An expression goes to the outermost loop it does not change in, unless part of it can go
+		# further out
+		if isinstance(node, varNode):
+			return node, {node.node.value}, []
+		if isinstance(node, (numberNode, stringNode, booleanNode)):
+			return node, set(), []
+		if not isinstance(node, PURE_NODES):
+			return node, None, []
+
+		if isinstance(node, (binOpNode, stringOpNode, equalityNode)):
+			fields = ['left_node', 'right_node']
+		elif isinstance(node, unaryOpNode):
+			fields = ['node']
+		else:
+			fields = ['token']
+
+		new_node = copy.copy(node)
+		names = set()
+		hoisted = []
+		for field in fields:
+			child, child_names, child_hoisted = self.hoistExpr(getattr(node, field), loops, limit)
+			setattr(new_node, field, child)
+			names = None if names is None or child_names is None else names | child_names
+			hoisted += child_hoisted
+
+		level = None if names is None else self.invariantLevel(names, loops, limit)
+		if level is not None and all(child_level >= level for child_level, invariant in hoisted):
+			# x and +x are only a lookup of the saved value, caching them would not save anything
+			if passThroughVar(node) is not None:
+				return node, names, []
+			invariant = invariantNode(node)
+			return invariant, names, [(level, invariant)]
+		return new_node, names, hoisted
 
-		if error:
-			return res.failure(error), None
+################
+# TYPE INFERENCE
+################
 
-		return res.success(result.setPos(node.pos_start, node.pos_end)), node.output
+NO_TYPES = frozenset()
+NUMBER_TYPES = frozenset([T_INT, T_FLOAT])
+ALL_TYPES = frozenset([T_INT, T_FLOAT, T_STRING, T_BOOLEAN])
+
+VALUE_TYPES = {
+	int: T_INT,
+	float: T_FLOAT,
+	str: T_STRING,
+	bool: T_BOOLEAN,
+}
+
+def valueType(value):
+	return VALUE_TYPES.get(type(value))
+
+def savedVarTypes(variables=VARS_SAVED):
+	# The types of the variables already saved, which a program can read before it assigns them itself
+	return tuple(sorted((name, valueType(value)) for name, value in variables.items() if valueType(value)))
+
+def numberResultType(op_tok_type, left_type, right_type):
+	if op_tok_type == T_DIVIDE or T_FLOAT in [left_type, right_type]:
+		return T_FLOAT
+	return T_INT
+
+
+class TypeInference:
+	# Works out the set of types each expression can produce if it does not fail. A variable can hold anything
+	# which is assigned to it anywhere in the program, as well as the type it was saved with before the program ran
+	def __init__(self, program=None, var_types=()):
+		self.var_types = {name: frozenset([value_type]) for name, value_type in var_types}
+
+		stores = []
+		for statement in program or []:
+			for node in iterNodes(statement):
+				if isinstance(node, varAssignNode):
+					stores.append((node.varNode.value, node.node))
+				elif isinstance(node, forNode):
+					stores.append((node.var_node.node.value, node.from_node.node))
+
+		# Assignments can read other variables, so keep going until none of the types grow
+		changed = True
+		while changed:
+			changed = False
+			for name, value_node in stores:
+				types = self.var_types.get(name, NO_TYPES) | self.typeOf(value_node)
+				if types != self.var_types.get(name, NO_TYPES):
+					self.var_types[name] = types
+					changed = True
+
+	def typeOf(self, node):
+		method = findNodeMethod(self, 'type_', node)
+		if method is None:
+			return ALL_TYPES
+		return method(node)
+
+	def isOnly(self, node, types):
+		node_types = self.typeOf(node)
+		return bool(node_types) and node_types <= types
+
+	def type_numberNode(self, node):
+		return frozenset([T_INT if type(node.token.value) == int else T_FLOAT])
+
+	def type_stringNode(self, node):
+		return frozenset([T_STRING])
+
+	def type_booleanNode(self, node):
+		return frozenset([T_BOOLEAN])
+
+	def type_varNode(self, node):
+		return self.var_types.get(node.node.value, NO_TYPES)
+
+	def type_binOpNode(self, node):
+		left_types = self.typeOf(node.left_node)
+		right_types = self.typeOf(node.right_node)
+		op_tok_type = node.op_token.type
+		types = set()
+		for l in left_types:
+			for r in right_types:
+				if l in NUMBER_TYPES and r in NUMBER_TYPES:
+					types.add(numberResultType(op_tok_type, l, r))
+				elif l == T_STRING and op_tok_type == T_MULTIPLY and r == T_INT:
+					# A string multiplied by a number is repeated like in python
+					types.add(T_STRING)
+				else:
+					# Anything else is left to the generic node
+					return ALL_TYPES
+		return frozenset(types)
+
+	def type_unaryOpNode(self, node):
+		types = self.typeOf(node.node)
+		if node.op_token.type != T_MINUS:
+			return types
+		# Negating a string multiplies it by -1, which gives an empty string
+		return types & (NUMBER_TYPES | frozenset([T_STRING]))
+
+	def type_stringLengthNode(self, node):
+		if T_STRING in self.typeOf(node.token):
+			return frozenset([T_INT])
+		return NO_TYPES
+
+	def type_stringOpNode(self, node):
+		left_types = self.typeOf(node.left_node)
+		right_types = self.typeOf(node.right_node)
+		if node.op_token.type == T_JOIN:
+			if T_STRING in left_types and T_STRING in right_types:
+				return frozenset([T_STRING])
+			return NO_TYPES
+
+		types = set()
+		for l in left_types:
+			for r in right_types:
+				if T_STRING in [l, r] and T_INT in [l, r]:
+					types.add(T_STRING)
+				elif l in NUMBER_TYPES and r in NUMBER_TYPES:
+					types.add(numberResultType(T_MULTIPLY, l, r))
+		return frozenset(types)
+
+	def type_equalityNode(self, node):
+		return frozenset([T_BOOLEAN])
+
+	def type_invariantNode(self, node):
+		return self.typeOf(node.node)
+
+	def specialize(self, node):
+		# Returns the type specialised version of a node whose operand types are known, or the node itself
+		method = getattr(self, f'specialize_{type(node).__name__}', None)
+		new_node = method(node) if method else None
+		if new_node is None:
+			return node
+		new_node.output = node.output
+		return new_node
+
+	def specialize_binOpNode(self, node):
+		if self.isOnly(node.left_node, NUMBER_TYPES) and self.isOnly(node.right_node, NUMBER_TYPES):
+			return numberBinOpNode(node.left_node, node.op_token, node.right_node)
+
+	def specialize_unaryOpNode(self, node):
+		if node.op_token.type == T_MINUS and self.isOnly(node.node, NUMBER_TYPES):
+			return numberNegateNode(node.op_token, node.node)
+
+	def specialize_stringOpNode(self, node):
+		strings = frozenset([T_STRING])
+		ints = frozenset([T_INT])
+		if node.op_token.type == T_JOIN:
+			if self.isOnly(node.left_node, strings) and self.isOnly(node.right_node, strings):
+				return stringJoinNode(node.left_node, node.op_token, node.right_node)
+		elif self.isOnly(node.left_node, strings) and self.isOnly(node.right_node, ints):
+			return stringRepeatNode(node.left_node, node.op_token, node.right_node, string_first=True)
+		elif self.isOnly(node.left_node, ints) and self.isOnly(node.right_node, strings):
+			return stringRepeatNode(node.left_node, node.op_token, node.right_node, string_first=False)
+
+	def specialize_equalityNode(self, node):
+		if self.isOnly(node.left_node, NUMBER_TYPES) and self.isOnly(node.right_node, NUMBER_TYPES):
+			return numberEqualityNode(node.left_node, node.op_token, node.right_node)
+		strings = frozenset([T_STRING])
+		if self.isOnly(node.left_node, strings) and self.isOnly(node.right_node, strings):
+			return stringEqualityNode(node.left_node, node.op_token, node.right_node)
 
-	def visit_equalityNode(self, node):
-		res = RunTimeResult()
-		left = res.register(self.visit(node.left_node))
-		right = res.register(self.visit(node.right_node))
-		op_tok = node.op_token
-		
-		if res.error: return res, None
-		
-		comp = Comparision(left, op_tok, right)
-		result, error = comp.compare()
+################
+# COMPILER
+################
 
-		if error:
-			return res.failure(error), None
+# Expression opcodes
+OP_CONST = 'CONST'
+OP_LOAD = 'LOAD'
+OP_BINOP = 'BINOP'
+OP_UNARY = 'UNARY'
+OP_STRLEN = 'STRLEN'
+OP_STROP = 'STROP'
+OP_EQUALITY = 'EQUALITY'
+OP_NUMBER_BINOP = 'NUMBER_BINOP'
+OP_NUMBER_BINOP_CONST = 'NUMBER_BINOP_CONST'
+OP_NUMBER_NEGATE = 'NUMBER_NEGATE'
+OP_STRING_JOIN = 'STRING_JOIN'
+OP_STRING_REPEAT = 'STRING_REPEAT'
+OP_NUMBER_EQUALITY = 'NUMBER_EQUALITY'
+OP_STRING_EQUALITY = 'STRING_EQUALITY'
+OP_INVARIANT = 'INVARIANT'
+OP_SAVE_INVARIANT = 'SAVE_INVARIANT'
+
+# Statement opcodes
+OP_ASSIGN = 'ASSIGN'
+OP_RESULT = 'RESULT'
+OP_BREAK = 'BREAK'
+OP_CLEAR = 'CLEAR'
+OP_ECHO = 'ECHO'
+OP_LOOP_LINE = 'LOOP_LINE'
+OP_END_BLOCK = 'END_BLOCK'
+OP_JUMP = 'JUMP'
+OP_JUMP_IF_FALSE = 'JUMP_IF_FALSE'
+OP_SWITCH = 'SWITCH'
+OP_RESET_INVARIANTS = 'RESET_INVARIANTS'
+OP_FOR_RANGE = 'FOR_RANGE'
+OP_FOR_ITER = 'FOR_ITER'
+OP_FOR_INCR = 'FOR_INCR'
+OP_FOR_NEXT = 'FOR_NEXT'
+OP_POP = 'POP'
+OP_FAIL = 'FAIL'
+OP_RETURN = 'RETURN'
+
+
+class Instruction:
+	def __init__(self, op, arg=None):
+		self.op = op
+		self.arg = arg
 
-		return res.success(result.setPos(node.pos_start, node.pos_end)), node.output
+	def __repr__(self):
+		if self.arg is None:
+			return f'{self.op}'
+		return f'{self.op} {self.arg}'
 
-	def visit_conditionalNode(self, node):
-		res = RunTimeResult()
-		result = None
-		if_comparision_val, output = self.visit(node.if_node.if_comp_node.node)
-		if if_comparision_val.error: return if_comparision_val, None
 
-		# print(if_comparision_val.value.value)
+class Compiler:
+	def __init__(self, debug=False):
+		self.debug = debug
+		self.code = []
 
-		if if_comparision_val.value.value:
-			for line in node.if_node.if_code_nodes:
-				result, output = self.visit(line)
-				if result:
-					if result.error: return result, None
+	def compile(self, node):
+		self.compileStatement(node)
+		self.emit(OP_RETURN)
+		return [(instr.op, instr.arg) for instr in self.code]
 
-					if output or self.debug:
-						print(result.value)
-		else:
-			elseif_completed = False
-			if node.elseif_nodes:
-				# go through each comp_node
-				# whichever comp_node comes up as being True first, do code of that node
-				for elseif_node in node.elseif_nodes:
-					elseif_comparision_val, output = self.visit(elseif_node.elseif_comp_node.node)
-					if elseif_comparision_val.error: return elseif_comparision_val, None
-					
-					# print(elseif_comparision_val.value.value)
-					if elseif_comparision_val.value.value:
-						for line in elseif_node.elseif_code_nodes:
-							result, output = self.visit(line)
-							if result:
-								if result.error: return result, None
-
-								if output or self.debug:
-									print(result.value)
-						elseif_completed = True
-						break
-
-			if node.else_node and not elseif_completed:
-				for line in node.else_node.else_code_nodes:
-					result, output = self.visit(line)
-					if result:
-						if result.error: return result, None
-
-						if output or self.debug:
-							print(result.value)
-
-		if not result:
-			return None, None
+	def emit(self, op, arg=None):
+		self.code.append(Instruction(op, arg))
+		return len(self.code) - 1
+
+	def patch(self, idx, target=None):
+		self.code[idx].arg = len(self.code) if target is None else target
+
+	def compileStatement(self, node):
+		if isinstance(node, (varAssignNode, conditionalNode, forNode, breakNode)):
+			self.compileNode(node)
 		else:
-			return res.success(result.value), None
-	
-	def visit_forNode(self, node):
-		res = RunTimeResult()
-		result = None
-		var_val = node.var_node.node.value
-		from_val = res.register(self.visit(node.from_node.node))
-		to_val = res.register(self.visit(node.to_node.node))
-		VARS_SAVED[var_val] = res.register(self.visit(node.from_node.node))
-		break_loop = False
+			self.compileNode(node)
+			self.emit(OP_RESULT, node.output)
+
+	def compileNode(self, node):
+		method = findNodeMethod(self, 'compile_', node) or self.noCompileMethod
+		method(node)
+
+	def noCompileMethod(self, node):
+		# The tree walker only fails once it reaches a node it cannot visit, so do the same at run time
+		self.emit(OP_FAIL, f'No visit_{type(node).__name__} method defined')
+
+	def compile_numberNode(self, node):
+		self.emit(OP_CONST, node.token.value)
+
+	def compile_stringNode(self, node):
+		self.emit(OP_CONST, node.token.value)
+
+	def compile_booleanNode(self, node):
+		self.emit(OP_CONST, node.token.value)
+
+	def compile_invariantNode(self, node):
+		# INVARIANT pushes the cached value and jumps past the expression, once it has been worked out since the loop started
+		load = self.emit(OP_INVARIANT)
+		self.compileNode(node.node)
+		self.emit(OP_SAVE_INVARIANT, node)
+		self.code[load].arg = (node, len(self.code))
+
+	def compile_varNode(self, node):
+		self.emit(OP_LOAD, node)
+
+	def compile_binOpNode(self, node):
+		self.compileNode(node.left_node)
+		self.compileNode(node.right_node)
+		self.emit(OP_BINOP, node)
+
+	def compile_numberBinOpNode(self, node):
+		self.compileNode(node.left_node)
+		right = node.right_node
+		if isinstance(right, numberNode) and (right.token.value or node.op_token.type != T_DIVIDE):
+			# A number on the right can never fail, so it is kept in the instruction instead of being pushed
+			self.emit(OP_NUMBER_BINOP_CONST, (node.operator, right.token.value))
+			return
+		self.compileNode(right)
+		self.emit(OP_NUMBER_BINOP, node)
+
+	def compile_unaryOpNode(self, node):
+		self.compileNode(node.node)
+		self.emit(OP_UNARY, node)
+
+	def compile_numberNegateNode(self, node):
+		self.compileNode(node.node)
+		self.emit(OP_NUMBER_NEGATE)
+
+	def compile_stringLengthNode(self, node):
+		self.compileNode(node.token)
+		self.emit(OP_STRLEN, node)
+
+	def compile_stringOpNode(self, node):
+		self.compileNode(node.left_node)
+		self.compileNode(node.right_node)
+		self.emit(OP_STROP, node)
+
+	def compile_stringJoinNode(self, node):
+		self.compileNode(node.left_node)
+		self.compileNode(node.right_node)
+		self.emit(OP_STRING_JOIN)
+
+	def compile_stringRepeatNode(self, node):
+		self.compileNode(node.left_node)
+		self.compileNode(node.right_node)
+		self.emit(OP_STRING_REPEAT)
+
+	def compile_equalityNode(self, node):
+		self.compileNode(node.left_node)
+		self.compileNode(node.right_node)
+		self.emit(OP_EQUALITY, node)
+
+	def compile_numberEqualityNode(self, node):
+		self.compileNode(node.left_node)
+		self.compileNode(node.right_node)
+		self.emit(OP_NUMBER_EQUALITY, node.operator)
+
+	def compile_stringEqualityNode(self, node):
+		self.compileNode(node.left_node)
+		self.compileNode(node.right_node)
+		self.emit(OP_STRING_EQUALITY, node)
+
+	def compile_varAssignNode(self, node):
+		# STORE and RESULT in one instruction
+		self.compileNode(node.node)
+		self.emit(OP_ASSIGN, (node.slot, node.output))
+
+	def compile_breakNode(self, node):
+		self.emit(OP_BREAK)
+
+	def echoes(self, line):
+		# Only an expression line with OUTPUT, or any line in debug mode, writes its value. Other lines do not need an ECHO
+		return statementOutput(line) or self.debug
+
+	def compileBlock(self, code_nodes):
+		for line in code_nodes:
+			self.compileStatement(line)
+			if self.echoes(line):
+				self.emit(OP_ECHO)
+
+	def compile_conditionalNode(self, node):
+		self.emit(OP_CLEAR)
+		self.compileArms(node)
+
+	def compile_switchNode(self, node):
+		# SWITCH jumps to the block of the arm the table gives, a value of another type goes through the comparisions
+		self.emit(OP_CLEAR)
+		switch = self.emit(OP_SWITCH)
+		arm_starts, else_start = self.compileArms(node)
+		self.code[switch].arg = (node.slot, node.value_type, node.table, arm_starts, else_start)
+
+	def compileArms(self, node):
+		# Returns where the block of each arm and the else block start
+		end_jumps = []
+		arm_starts = []
+		arms = [(node.if_node.if_comp_node.node, node.if_node.if_code_nodes)]
+		arms += [(elseif_node.elseif_comp_node.node, elseif_node.elseif_code_nodes) for elseif_node in node.elseif_nodes]
+
+		for comp_node, code_nodes in arms:
+			self.compileNode(comp_node)
+			next_arm = self.emit(OP_JUMP_IF_FALSE)
+			arm_starts.append(len(self.code))
+			self.compileBlock(code_nodes)
+			end_jumps.append(self.emit(OP_JUMP))
+			self.patch(next_arm)
+
+		else_start = len(self.code)
+		if node.else_node:
+			self.compileBlock(node.else_node.else_code_nodes)
+
+		for idx in end_jumps:
+			self.patch(idx)
+		self.emit(OP_END_BLOCK)
+		return arm_starts, else_start
+
+	def compile_forNode(self, node):
+		if node.invariant_nodes:
+			self.emit(OP_RESET_INVARIANTS, node.invariant_nodes)
+		slot = node.var_node.slot
+		self.compileNode(node.from_node.node)
+		self.compileNode(node.to_node.node)
+		self.emit(OP_FOR_RANGE, slot)
+		self.emit(OP_CLEAR)
+
+		loop_start = len(self.code)
+		loop_exit = self.emit(OP_FOR_ITER)
+		break_jumps = []
+		for line in node.code_nodes:
+			self.compileStatement(line)
+			if isinstance(line, (conditionalNode, forNode, breakNode)):
+				# Only these lines can give back a BREAK
+				break_jumps.append(self.emit(OP_LOOP_LINE))
+			elif self.echoes(line):
+				self.emit(OP_ECHO)
+		self.emit(OP_FOR_NEXT, (slot, loop_start))
+
+		for idx in break_jumps:
+			self.patch(idx)
+		self.emit(OP_FOR_INCR, slot)
+		self.emit(OP_POP)
+		self.patch(loop_exit)
+		self.emit(OP_END_BLOCK)
 
-		for i in range(from_val.value, to_val.value):
-			if break_loop:
-				break
-			for line in node.code_nodes:
-				result, output = self.visit(line)
-				if result:
-					if result.error: return result, None
+################
+# VIRTUAL MACHINE
+################
 
-					if result.value == 'break':
-						break_loop = True
-						break
+class Failure:
+	# Stands in for a value whose evaluation failed, so an expression keeps the last error like Interpreter.visitOperands
+	def __init__(self, error):
+		self.error = error
 
-					if output or self.debug:
-						print(result.value)
-				
-			VARS_SAVED[var_val].value += 1
 
-		if not result:
-			return None, None
+class VirtualMachine:
+	# Compiled like the closure and python engines, each statement becomes a function which runs its bytecode with the
+	# values, output and invariant values it is called with
+	def __init__(self, debug=False, context=None, values=None):
+		self.context = DEFAULT_CONTEXT if context is None else context
+		self.values = [] if values is None else values
+		self.debug = debug
+		self.invariant_values = {}
+
+	def execute(self, node):
+		return runCompiledStatement(self.compile(node), statementOutput(node), self.values, self.context.output, self.invariant_values)
+
+	def compileStatements(self, nodes, file_name='<engpy>'):
+		return [self.compile(node) for node in nodes]
+
+	def compile(self, node):
+		code = Compiler(self.debug).compile(node)
+		run_code = self.runCode
+		def statement(values, sink, invariant_values):
+			return run_code(code, values, sink, invariant_values)
+		return statement
+
+	def runCode(self, code, values, output, invariant_values):
+		# Returns the value of the statement, or raises an ExecutionError like the closures do
+		debug = self.debug
+		write = output.write
+		stack = []
+		push = stack.append
+		pop = stack.pop
+		has_result = False
+		last_value = None
+		last_output = None
+		pc = 0
+
+		while True:
+			op, arg = code[pc]
+			pc += 1
+
+			if op == OP_LOAD:
+				value = values[arg.slot]
+				if value is None:
+					push(Failure(RunTimeError(arg.pos_start, arg.pos_end, f'No variable with name {arg.node.value} defined')))
+				else:
+					push(value)
+
+			elif op == OP_CONST:
+				push(arg)
+
+			elif op == OP_NUMBER_BINOP:
+				right = pop()
+				left = pop()
+				if type(right) == Failure:
+					push(right)
+				elif type(left) == Failure:
+					push(left)
+				elif right == 0 and arg.op_token.type == T_DIVIDE:
+					push(Failure(RunTimeError(arg.right_node.pos_start, arg.right_node.pos_end, 'Division by zero')))
+				else:
+					push(arg.operator(left, right))
+
+			elif op == OP_NUMBER_BINOP_CONST:
+				left = pop()
+				push(left if type(left) == Failure else arg[0](left, arg[1]))
+
+			elif op == OP_ASSIGN:
+				value = pop()
+				if type(value) == Failure:
+					values[arg[0]] = None
+					raise ExecutionError(value.error)
+				values[arg[0]] = value
+				has_result = True
+				last_value = value
+				last_output = arg[1]
+
+			elif op == OP_LOOP_LINE:
+				if has_result:
+					if last_value is BREAK:
+						output.flush()
+						pc = arg
+					elif last_output or debug:
+						write(last_value)
+
+			elif op == OP_ECHO:
+				if has_result and (last_output or debug):
+					write(last_value)
+
+			elif op == OP_INVARIANT:
+				value = invariant_values.get(arg[0])
+				if value is not None:
+					push(value)
+					pc = arg[1]
+
+			elif op == OP_SAVE_INVARIANT:
+				value = stack[-1]
+				if type(value) != Failure:
+					invariant_values[arg] = value
+
+			elif op == OP_FOR_ITER:
+				if next(stack[-1], None) is None:
+					pop()
+					pc = arg
+
+			elif op == OP_FOR_NEXT:
+				values[arg[0]] += 1
+				pc = arg[1]
+
+			elif op == OP_FOR_INCR:
+				values[arg] += 1
+
+			elif op == OP_JUMP:
+				pc = arg
+
+			elif op == OP_NUMBER_EQUALITY:
+				right = pop()
+				left = pop()
+				if type(right) == Failure:
+					push(right)
+				elif type(left) == Failure:
+					push(left)
+				else:
+					push(arg(left, right))
+
+			elif op == OP_JUMP_IF_FALSE:
+				value = pop()
+				if type(value) == Failure:
+					raise ExecutionError(value.error)
+				if not value:
+					pc = arg
+
+			elif op == OP_BINOP:
+				right = pop()
+				left = pop()
+				if type(left) in NUMBER_VALUES and type(right) in NUMBER_VALUES and (right or arg.op_token.type != T_DIVIDE):
+					# Fast path for the common case, same results as binaryOperation
+					push(NUMBER_OPERATORS[arg.op_token.type](left, right))
+					continue
+
+				if type(right) == Failure:
+					push(right)
+				elif type(left) == Failure:
+					push(left)
+				else:
+					try:
+						push(binaryOperation(arg, left, right))
+					except ExecutionError as e:
+						push(Failure(e.error))
+
+			elif op == OP_RESULT:
+				value = pop()
+				if type(value) == Failure:
+					raise ExecutionError(value.error)
+				has_result = True
+				last_value = value
+				last_output = arg
+
+			elif op == OP_EQUALITY:
+				right = pop()
+				left = pop()
+				if type(right) == Failure:
+					push(right)
+				elif type(left) == Failure:
+					push(left)
+				else:
+					try:
+						push(compareValues(arg, left, right))
+					except ExecutionError as e:
+						push(Failure(e.error))
+
+			elif op == OP_STRING_JOIN or op == OP_STRING_REPEAT:
+				right = pop()
+				left = pop()
+				if type(right) == Failure:
+					push(right)
+				elif type(left) == Failure:
+					push(left)
+				else:
+					push(left + right if op == OP_STRING_JOIN else left * right)
+
+			elif op == OP_STRING_EQUALITY:
+				right = pop()
+				left = pop()
+				if type(right) == Failure:
+					push(right)
+				elif type(left) == Failure:
+					push(left)
+				elif arg.compare_lengths:
+					push(arg.operator(len(left), len(right)))
+				else:
+					push(arg.operator(left, right))
+
+			elif op == OP_STROP:
+				right = pop()
+				left = pop()
+				if type(right) == Failure:
+					push(right)
+				elif type(left) == Failure:
+					push(left)
+				else:
+					try:
+						push(stringOperation(arg, left, right))
+					except ExecutionError as e:
+						push(Failure(e.error))
+
+			elif op == OP_UNARY:
+				value = pop()
+				push(value if type(value) == Failure else unaryOperation(arg, value))
+
+			elif op == OP_NUMBER_NEGATE:
+				value = pop()
+				push(value if type(value) == Failure else value * -1)
+
+			elif op == OP_STRLEN:
+				string = pop()
+				push(string if type(string) == Failure else len(string))
+
+			elif op == OP_SWITCH:
+				slot, value_type, table, arm_starts, else_start = arg
+				value = values[slot]
+				# A value of another type falls through to the comparisions, which report the error
+				if type(value) in value_type:
+					arm = table.get(value)
+					pc = else_start if arm is None else arm_starts[arm]
+
+			elif op == OP_BREAK:
+				has_result = True
+				last_value = BREAK
+				last_output = None
+
+			elif op == OP_CLEAR:
+				has_result = False
+				last_value = None
+
+			elif op == OP_END_BLOCK:
+				last_output = None
+
+			elif op == OP_FOR_RANGE:
+				to_val = pop()
+				from_val = pop()
+				# A failed bound leaves visit_forNode with None, so fail the same way
+				if type(from_val) == Failure: from_val = None
+				if type(to_val) == Failure: to_val = None
+				iterations = range(from_val, to_val)
+				values[arg] = from_val
+				push(iter(iterations))
+
+			elif op == OP_RESET_INVARIANTS:
+				for invariant in arg:
+					invariant_values.pop(invariant, None)
+
+			elif op == OP_POP:
+				pop()
+
+			elif op == OP_FAIL:
+				raise Exception(arg)
+
+			elif op == OP_RETURN:
+				return last_value if has_result else None
+
+################
+# CLOSURE COMPILER
+################
+
+def runCompiledStatement(closure, output, values, sink, invariant_values=None):
+	# Compiled code is given the frame and output it runs with each time it is called, so one compiled program can be
+	# run by any number of contexts
+	try:
+		value = closure(values, sink, {} if invariant_values is None else invariant_values)
+	except ExecutionError as e:
+		return RunTimeResult().failure(e.error), None
+
+	if value is None:
+		return None, None
+	return RunTimeResult().success(value), output
+
+def statementPosition(node):
+	if isinstance(node, conditionalNode):
+		return node.if_node.if_node.pos_start
+	elif isinstance(node, forNode):
+		return node.var_node.pos_start
+	elif isinstance(node, breakNode):
+		return node.break_node.pos_start
+	return getattr(node, 'pos_start', None)
+
+def statementOutput(node):
+	# The output flag the Interpreter returns alongside the result of a statement
+	if isinstance(node, (conditionalNode, forNode, breakNode)):
+		return None
+	return node.output
+
+
+class ClosureCompiler:
+	# Every closure is called with the list of variable values, the output sink and the cached invariant values of the run
+
+	def __init__(self, debug=False, context=None, values=None):
+		self.context = DEFAULT_CONTEXT if context is None else context
+		self.values = [] if values is None else values
+		self.debug = debug
+		self.invariant_values = {}
+
+	def execute(self, node):
+		return runCompiledStatement(self.compile(node), statementOutput(node), self.values, self.context.output, self.invariant_values)
+
+	def compileStatements(self, nodes, file_name='<engpy>'):
+		return [self.compile(node) for node in nodes]
+
+	def compile(self, node):
+		method = findNodeMethod(self, 'compile_', node) or self.noCompileMethod
+		return method(node)
+
+	def noCompileMethod(self, node):
+		message = f'No visit_{type(node).__name__} method defined'
+		def fail(values, sink, invariant_values):
+			raise Exception(message)
+		return fail
+
+	def compile_numberNode(self, node):
+		value = node.token.value
+		def number(values, sink, invariant_values):
+			return value
+		return number
+
+	def compile_stringNode(self, node):
+		value = node.token.value
+		def string(values, sink, invariant_values):
+			return value
+		return string
+
+	def compile_booleanNode(self, node):
+		value = node.token.value
+		def boolean(values, sink, invariant_values):
+			return value
+		return boolean
+
+	def compile_varNode(self, node):
+		slot = node.slot
+		name = node.node.value
+		pos_start, pos_end = node.pos_start, node.pos_end
+		def var(values, sink, invariant_values):
+			value = values[slot]
+			if value is None:
+				raise ExecutionError(RunTimeError(pos_start, pos_end, f'No variable with name {name} defined'))
+			return value
+		return var
+
+	def compileOperands(self, node):
+		left_fn = self.compile(node.left_node)
+		right_fn = self.compile(node.right_node)
+		def operands(values, sink, invariant_values):
+			try:
+				left = left_fn(values, sink, invariant_values)
+			except ExecutionError:
+				# Like Interpreter.visitOperands, an error from the right operand replaces the one from the left
+				right_fn(values, sink, invariant_values)
+				raise
+			return left, right_fn(values, sink, invariant_values)
+		return operands
+
+	def compile_binOpNode(self, node):
+		operands = self.compileOperands(node)
+		def binOp(values, sink, invariant_values):
+			left, right = operands(values, sink, invariant_values)
+			return binaryOperation(node, left, right)
+		return binOp
+
+	def compile_numberBinOpNode(self, node):
+		operands = self.compileOperands(node)
+		number_operator = node.operator
+		divide = node.op_token.type == T_DIVIDE
+		pos_start, pos_end = node.right_node.pos_start, node.right_node.pos_end
+		def numberBinOp(values, sink, invariant_values):
+			left, right = operands(values, sink, invariant_values)
+			if divide and right == 0:
+				raise ExecutionError(RunTimeError(pos_start, pos_end, 'Division by zero'))
+			return number_operator(left, right)
+		return numberBinOp
+
+	def compile_numberNegateNode(self, node):
+		operand = self.compile(node.node)
+		def numberNegate(values, sink, invariant_values):
+			return operand(values, sink, invariant_values) * -1
+		return numberNegate
+
+	def compile_stringJoinNode(self, node):
+		operands = self.compileOperands(node)
+		def stringJoin(values, sink, invariant_values):
+			left, right = operands(values, sink, invariant_values)
+			return left + right
+		return stringJoin
+
+	def compile_stringRepeatNode(self, node):
+		operands = self.compileOperands(node)
+		def stringRepeat(values, sink, invariant_values):
+			left, right = operands(values, sink, invariant_values)
+			return left * right
+		return stringRepeat
+
+	def compile_numberEqualityNode(self, node):
+		operands = self.compileOperands(node)
+		comparision_operator = node.operator
+		def numberEquality(values, sink, invariant_values):
+			left, right = operands(values, sink, invariant_values)
+			return comparision_operator(left, right)
+		return numberEquality
+
+	def compile_stringEqualityNode(self, node):
+		operands = self.compileOperands(node)
+		comparision_operator = node.operator
+		compare_lengths = node.compare_lengths
+		def stringEquality(values, sink, invariant_values):
+			left, right = operands(values, sink, invariant_values)
+			if compare_lengths:
+				return comparision_operator(len(left), len(right))
+			return comparision_operator(left, right)
+		return stringEquality
+
+	def compile_invariantNode(self, node):
+		inner = self.compile(node.node)
+		def invariant(values, sink, invariant_values):
+			value = invariant_values.get(node)
+			if value is None:
+				value = inner(values, sink, invariant_values)
+				invariant_values[node] = value
+			return value
+		return invariant
+
+	def compile_unaryOpNode(self, node):
+		operand = self.compile(node.node)
+		def unaryOp(values, sink, invariant_values):
+			return unaryOperation(node, operand(values, sink, invariant_values))
+		return unaryOp
+
+	def compile_stringLengthNode(self, node):
+		operand = self.compile(node.token)
+		def stringLength(values, sink, invariant_values):
+			return len(operand(values, sink, invariant_values))
+		return stringLength
+
+	def compile_stringOpNode(self, node):
+		operands = self.compileOperands(node)
+		def stringOp(values, sink, invariant_values):
+			left, right = operands(values, sink, invariant_values)
+			return stringOperation(node, left, right)
+		return stringOp
+
+	def compile_equalityNode(self, node):
+		operands = self.compileOperands(node)
+		def equality(values, sink, invariant_values):
+			left, right = operands(values, sink, invariant_values)
+			return compareValues(node, left, right)
+		return equality
+
+	def compile_varAssignNode(self, node):
+		value_fn = self.compile(node.node)
+		slot = node.slot
+		def varAssign(values, sink, invariant_values):
+			try:
+				value = value_fn(values, sink, invariant_values)
+			except ExecutionError:
+				values[slot] = None
+				raise
+			values[slot] = value
+			return value
+		return varAssign
+
+	def compile_breakNode(self, node):
+		def breakStatement(values, sink, invariant_values):
+			return BREAK
+		return breakStatement
+
+	def compileBlock(self, code_nodes):
+		lines = [(self.compile(line), statementOutput(line) or self.debug) for line in code_nodes]
+		def block(values, sink, invariant_values):
+			result = None
+			for closure, output in lines:
+				result = closure(values, sink, invariant_values)
+				if output and result is not None:
+					sink.write(result)
+			return result
+		return block
+
+	def compile_conditionalNode(self, node):
+		arms = [(self.compile(node.if_node.if_comp_node.node), self.compileBlock(node.if_node.if_code_nodes))]
+		for elseif_node in node.elseif_nodes:
+			arms.append((self.compile(elseif_node.elseif_comp_node.node), self.compileBlock(elseif_node.elseif_code_nodes)))
+		else_block = self.compileBlock(node.else_node.else_code_nodes) if node.else_node else None
+
+		def conditional(values, sink, invariant_values):
+			for comparision, block in arms:
+				if comparision(values, sink, invariant_values):
+					return block(values, sink, invariant_values)
+			if else_block:
+				return else_block(values, sink, invariant_values)
+			return None
+		return conditional
+
+	def compile_switchNode(self, node):
+		comparisions = [self.compile(node.if_node.if_comp_node.node)]
+		comparisions += [self.compile(elseif_node.elseif_comp_node.node) for elseif_node in node.elseif_nodes]
+		blocks = [self.compileBlock(node.armCode(arm)) for arm in range(len(comparisions))]
+		else_block = self.compileBlock(node.else_node.else_code_nodes) if node.else_node else None
+		slot = node.slot
+		value_type = node.value_type
+		table = node.table
+
+		def switch(values, sink, invariant_values):
+			value = values[slot]
+			if type(value) not in value_type:
+				for comparision, block in zip(comparisions, blocks):
+					if comparision(values, sink, invariant_values):
+						return block(values, sink, invariant_values)
+			else:
+				arm = table.get(value)
+				if arm is not None:
+					return blocks[arm](values, sink, invariant_values)
+
+			if else_block:
+				return else_block(values, sink, invariant_values)
+			return None
+		return switch
+
+	def compile_forNode(self, node):
+		slot = node.var_node.slot
+		from_fn = self.compile(node.from_node.node)
+		to_fn = self.compile(node.to_node.node)
+		lines = [(self.compile(line), statementOutput(line) or self.debug) for line in node.code_nodes]
+
+		def boundValue(closure, values, sink, invariant_values):
+			# visit_forNode ignores errors in its bounds and carries on with None
+			try:
+				return closure(values, sink, invariant_values)
+			except ExecutionError:
+				return None
+
+		invariant_nodes = node.invariant_nodes
+
+		def forLoop(values, sink, invariant_values):
+			for invariant in invariant_nodes:
+				invariant_values.pop(invariant, None)
+			from_val = boundValue(from_fn, values, sink, invariant_values)
+			to_val = boundValue(to_fn, values, sink, invariant_values)
+			iterations = range(from_val, to_val)
+			values[slot] = from_val
+
+			write = sink.write
+			result = None
+			for i in iterations:
+				break_loop = False
+				for closure, output in lines:
+					result = closure(values, sink, invariant_values)
+					if result is not None:
+						if result is BREAK:
+							sink.flush()
+							break_loop = True
+							break
+						if output:
+							write(result)
+
+				values[slot] += 1
+				if break_loop:
+					break
+			return result
+		return forLoop
+
+
+################
+# PYTHON TRANSPILER
+################
+
+def loadVar(values, slot, name, pos_start, pos_end):
+	value = values[slot]
+	if value is None:
+		raise ExecutionError(RunTimeError(pos_start, pos_end, f'No variable with name {name} defined'))
+	return value
+
+def evaluateNode(node, values, sink):
+	# Only used after the left operand failed, to find out if the right operand fails as well
+	return ClosureCompiler().compile(node)(values, sink, {})
+
+def failNode(message):
+	raise Exception(message)
+
+TRANSPILER_RUNTIME = {
+	'BREAK': BREAK,
+	'ExecutionError': ExecutionError,
+	'loadVar': loadVar,
+	'binaryOperation': binaryOperation,
+	'unaryOperation': unaryOperation,
+	'stringOperation': stringOperation,
+	'compareValues': compareValues,
+	'evaluateNode': evaluateNode,
+	'failNode': failNode,
+}
+
+
+class PythonTranspiler:
+	def __init__(self, debug=False, context=None, values=None):
+		self.context = DEFAULT_CONTEXT if context is None else context
+		self.values = [] if values is None else values
+		self.debug = debug
+		self.lines = []
+		self.line_map = {}
+		self.constants = {}
+		self.constant_names = {}
+		self.indent = 0
+		self.temp_count = 0
+		self.pos = None
+
+	def execute(self, node):
+		return runCompiledStatement(self.compileStatements([node])[0], statementOutput(node), self.values, self.context.output)
+
+	def compileStatements(self, nodes, file_name='<engpy>'):
+		self.transpile(nodes)
+		namespace = dict(TRANSPILER_RUNTIME)
+		namespace.update(self.constants)
+		exec(compile(self.source(), f'<engpy {file_name}>', 'exec'), namespace)
+		return [namespace[f'statement_{idx}'] for idx in range(len(nodes))]
+
+	def source(self):
+		return '\n'.join(self.lines) + '\n'
+
+	def transpile(self, nodes):
+		for idx, node in enumerate(nodes):
+			self.temp_count = 0
+			self.pos = statementPosition(node)
+			# The generated code only reaches its context through the arguments, like the closures of the ClosureCompiler
+			self.emit(f'def statement_{idx}(VALUES, OUTPUT, INVARIANTS):')
+			self.indent += 1
+			if self.pos:
+				self.emit(f'# {self.pos.fn}, line {self.pos.ln + 1}')
+			self.statement(node)
+			self.emit('return result')
+			self.indent -= 1
+			self.emit('')
+		return self.source()
+
+	def emit(self, line):
+		self.lines.append('\t' * self.indent + line)
+		if self.pos:
+			self.line_map[len(self.lines)] = self.pos
+
+	def constant(self, value):
+		if id(value) not in self.constant_names:
+			name = f'k{len(self.constants)}'
+			self.constants[name] = value
+			self.constant_names[id(value)] = name
+		return self.constant_names[id(value)]
+
+	def temp(self):
+		self.temp_count += 1
+		return f't{self.temp_count}'
+
+	def positions(self, node):
+		return f'{self.constant(node.pos_start)}, {self.constant(node.pos_end)}'
+
+	def canFail(self, node):
+		return not isinstance(node, (numberNode, stringNode, booleanNode))
+
+	# Statements leave their value in the local 'result', like the last result in the Interpreter
+
+	def statement(self, node):
+		method = findNodeMethod(self, 'statement_', node)
+		if method:
+			method(node)
 		else:
-			return res.success(result.value), None
+			self.emit(f'result = {self.expr(node)}')
+
+	def statement_varAssignNode(self, node):
+		# Variables are read and written through their slots in VALUES, the name is only left in a comment
+		variable = f'VALUES[{node.slot}]'
+		if self.canFail(node.node):
+			self.emit('try:')
+			self.indent += 1
+			self.emit(f'result = {self.expr(node.node)}')
+			self.indent -= 1
+			self.emit('except ExecutionError:')
+			self.emit(f'\t{variable} = None')
+			self.emit('\traise')
+		else:
+			self.emit(f'result = {self.expr(node.node)}')
+		self.emit(f'{variable} = result  # {node.varNode.value}')
 
-	def visit_breakNode(self, node):
-		return RunTimeResult().success('break'), None
+	def statement_breakNode(self, node):
+		self.emit('result = BREAK')
 
+	def lineComment(self, node):
+		pos = statementPosition(node)
+		if pos:
+			if pos.ln != self.pos.ln:
+				self.emit(f'# line {pos.ln + 1}')
+			self.pos = pos
 
-class RunTimeResult:
-	def __init__(self):
-		self.value = None
-		self.error = None
+	def isExpressionLine(self, node):
+		# Lines which always give back a value, which can never be a break
+		return not isinstance(node, (conditionalNode, forNode, breakNode))
+
+	def block(self, code_nodes):
+		for line in code_nodes:
+			self.lineComment(line)
+			self.statement(line)
+			if self.isExpressionLine(line):
+				if statementOutput(line) or self.debug:
+					self.emit('OUTPUT.write(result)')
+			elif self.debug:
+				self.emit('if result is not None: OUTPUT.write(result)')
+
+	def statement_conditionalNode(self, node):
+		comp_nodes = [node.if_node.if_comp_node.node] + [elseif_node.elseif_comp_node.node for elseif_node in node.elseif_nodes]
+		code = [node.if_node.if_code_nodes] + [elseif_node.elseif_code_nodes for elseif_node in node.elseif_nodes]
+
+		self.emit('result = None')
+		if isinstance(node, switchNode):
+			conditions = self.switchArms(node, comp_nodes)
+		else:
+			conditions = [self.condition(comp_node) for comp_node in comp_nodes]
+
+		# The arms are kept at one level, a long ELSEIF chain would otherwise go past python's indentation limit
+		for idx, (condition, code_nodes) in enumerate(zip(conditions, code)):
+			self.emit(f'{"elif" if idx else "if"} {condition}:')
+			self.indent += 1
+			self.block(code_nodes)
+			self.indent -= 1
+
+		if node.else_node:
+			self.emit('else:')
+			self.indent += 1
+			self.block(node.else_node.else_code_nodes)
+			self.indent -= 1
+
+	def switchArms(self, node, comp_nodes):
+		# Values of the right type pick their arm from the table, anything else goes through the comparisons
+		value, arm = self.temp(), self.temp()
+		self.emit(f'{value} = VALUES[{node.slot}]  # {node.var_name}')
+		self.emit(f'if type({value}) in {self.constant(node.value_type)}:')
+		self.emit(f'\t{arm} = {self.constant(node.table)}.get({value})')
+		self.emit('else:')
+		self.indent += 1
+		conditions = [self.condition(comp_node) for comp_node in comp_nodes]
+		for idx, condition in enumerate(conditions):
+			self.emit(f'{"elif" if idx else "if"} {condition}:')
+			self.emit(f'\t{arm} = {idx}')
+		self.emit('else:')
+		self.emit(f'\t{arm} = None')
+		self.indent -= 1
+		return [f'{arm} == {idx}' for idx in range(len(comp_nodes))]
+
+	def condition(self, comp_node):
+		# A comparison which needs statements before it is wrapped in a function, so it can still sit in an elif
+		# and is only worked out once the arms before it were false
+		mark = len(self.lines)
+		function = self.temp()
+		self.emit(f'def {function}():')
+		self.indent += 1
+		condition = self.expr(comp_node)
+		self.indent -= 1
+		if len(self.lines) == mark + 1:
+			self.dropLines(mark)
+			return condition
+		self.emit(f'\treturn {condition}')
+		return f'{function}()'
+
+	def dropLines(self, mark):
+		del self.lines[mark:]
+		for line in [line for line in self.line_map if line > mark]:
+			del self.line_map[line]
+
+	def bound(self, node, name):
+		if not self.canFail(node):
+			self.emit(f'{name} = {self.expr(node)}')
+			return
+
+		# visit_forNode ignores errors in its bounds and carries on with None
+		self.emit('try:')
+		self.indent += 1
+		self.emit(f'{name} = {self.expr(node)}')
+		self.indent -= 1
+		self.emit('except ExecutionError:')
+		self.emit(f'\t{name} = None')
+
+	def statement_forNode(self, node):
+		variable = f'VALUES[{node.var_node.slot}]'
+		from_val, to_val, iterations = self.temp(), self.temp(), self.temp()
+		self.bound(node.from_node.node, from_val)
+		self.bound(node.to_node.node, to_val)
+		self.emit(f'{iterations} = range({from_val}, {to_val})')
+		self.emit(f'{variable} = {from_val}  # {node.var_node.node.value}')
+		self.emit('result = None')
+
+		self.emit(f'for {self.temp()} in {iterations}:')
+		self.indent += 1
+		for line in node.code_nodes:
+			self.lineComment(line)
+			self.statement(line)
+			if self.isExpressionLine(line):
+				if statementOutput(line) or self.debug:
+					self.emit('OUTPUT.write(result)')
+				continue
+
+			self.emit('if result is not None:')
+			self.emit('\tif result is BREAK:')
+			self.emit('\t\tOUTPUT.flush()')
+			self.emit(f'\t\t{variable} += 1')
+			self.emit('\t\tbreak')
+			if self.debug:
+				self.emit('\tOUTPUT.write(result)')
+		self.emit(f'{variable} += 1')
+		self.indent -= 1
+
+	# Expressions return python source for their value, emitting any statements they need first
+
+	def expr(self, node):
+		method = findNodeMethod(self, 'expr_', node)
+		if method is None:
+			return f"failNode({repr(f'No visit_{type(node).__name__} method defined')})"
+		return method(node)
+
+	def expr_numberNode(self, node):
+		return repr(node.token.value)
+
+	def expr_stringNode(self, node):
+		return repr(node.token.value)
+
+	def expr_invariantNode(self, node):
+		# Invariant values are not cached in the generated python, the expression is just run every time
+		return self.expr(node.node)
+
+	def expr_booleanNode(self, node):
+		return repr(node.token.value)
+
+	def expr_varNode(self, node):
+		return f'loadVar(VALUES, {node.slot}, {repr(node.node.value)}, {self.positions(node)})'
+
+	def operands(self, node):
+		if not (self.canFail(node.left_node) and self.canFail(node.right_node)):
+			return self.expr(node.left_node), self.expr(node.right_node)
+
+		# Like Interpreter.visitOperands, an error from the right operand replaces the one from the left
+		left = self.temp()
+		self.emit('try:')
+		self.indent += 1
+		self.emit(f'{left} = {self.expr(node.left_node)}')
+		self.indent -= 1
+		self.emit('except ExecutionError:')
+		self.emit(f'\tevaluateNode({self.constant(node.right_node)}, VALUES, OUTPUT)')
+		self.emit('\traise')
+		right = self.temp()
+		self.emit(f'{right} = {self.expr(node.right_node)}')
+		return left, right
+
+	def expr_binOpNode(self, node):
+		left, right = self.operands(node)
+		return f'binaryOperation({self.constant(node)}, {left}, {right})'
+
+	def expr_unaryOpNode(self, node):
+		return f'unaryOperation({self.constant(node)}, {self.expr(node.node)})'
+
+	def expr_stringLengthNode(self, node):
+		return f'len({self.expr(node.token)})'
+
+	def expr_stringOpNode(self, node):
+		left, right = self.operands(node)
+		return f'stringOperation({self.constant(node)}, {left}, {right})'
+
+	def expr_equalityNode(self, node):
+		left, right = self.operands(node)
+		return f'compareValues({self.constant(node)}, {left}, {right})'
 
-	def register(self, res):
-		if type(res) == tuple:
-			if res[0].error: self.error = res[0].error
-			return res[0].value
-		if res.error: self.error = res.error
-		return res.value
+################
+# COMPILED PROGRAMS
+################
 
-	def success(self, value):
-		self.value = value
-		return self
+COMPILERS = {
+	'vm': VirtualMachine,
+	'closure': ClosureCompiler,
+	'python': PythonTranspiler,
+}
 
-	def failure(self, error):
+
+class CompiledProgram:
+	# Holds no context of its own, the same compiled program can be run in any context. names is the name in each slot
+	def __init__(self, file_name, statements, names=(), remaining_tokens=None, error=None, source=None, line_map=None):
+		self.file_name = file_name
+		self.statements = statements
+		self.names = names
+		self.remaining_tokens = remaining_tokens
 		self.error = error
-		return self
+		self.source = source
+		self.line_map = line_map or {}
+
+	def run(self, context=None):
+		context = DEFAULT_CONTEXT if context is None else context
+		try:
+			stopped, error = self.runStatements(context)
+		finally:
+			context.output.flush()
+		return None, error
+
+	def runStatements(self, context):
+		# Returns whether the program stopped early because of an error, and the error if it was not reported already
+		values = context.variables.frame(self.names)
+		try:
+			return self.runFrame(context, values)
+		finally:
+			context.variables.store(self.names, values)
+
+	def runFrame(self, context, values):
+		invariant_values = {}
+		for closure, output in self.statements:
+			try:
+				result, output = runCompiledStatement(closure, output, values, context.output, invariant_values)
+			except Exception as e:
+				self.addSourceNote(e)
+				raise
+			if reportResult(self.file_name, result, output, sink=context.output): return True, None
+
+		if self.error: return True, self.error
+		if self.remaining_tokens:
+			# Parsing stopped here when the program was compiled, parse again so the error or exception surfaces now
+			stream, idx = self.remaining_tokens
+			ast = Parser(stream).parseLine(idx)
+			if ast.error: return True, ast.error
+		return False, None
+
+	def addSourceNote(self, exception):
+		# Point python exceptions raised inside transpiled code back at the engpy line they came from
+		pos = None
+		tb = exception.__traceback__
+		while tb:
+			if tb.tb_frame.f_code.co_filename == f'<engpy {self.file_name}>':
+				pos = self.line_map.get(tb.tb_lineno, pos)
+			tb = tb.tb_next
+
+		if pos and hasattr(exception, 'add_note'):
+			exception.add_note(f'File {pos.fn}, line {pos.ln + 1}')
+
+
+@functools.lru_cache(maxsize=32)
+def compileProgram(file_name, text, engine='closure', opt_level=1, var_types=(), cache=None):
+	program, error, remaining_tokens = loadProgram(file_name, text, opt_level, var_types, cache)
+	return compileParsed(file_name, engine, program, error, remaining_tokens)
+
+def compileParsed(file_name, engine, program, error=None, remaining_tokens=None):
+	compiler = COMPILERS[engine]()
+	closures = compiler.compileStatements(program, file_name)
+	statements = [(closure, statementOutput(node)) for closure, node in zip(closures, program)]
+
+	if isinstance(compiler, PythonTranspiler):
+		return CompiledProgram(file_name, statements, program.names, remaining_tokens, error, compiler.source(), compiler.line_map)
+	return CompiledProgram(file_name, statements, program.names, remaining_tokens, error)
 
 ################
-# FUNCTIONS
+# PROGRAM CACHE
 ################
 
-def run(file_name, text, debug=False):
-	lexer = Lexer(file_name, text)
-	tokens, error = lexer.makeTokens()
-	if error: return None, error
+# Where ProgramCache keeps its files unless it is given a directory, and how big they can get in total
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'engpy')
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Starts every cache file, the number goes up whenever the classes which get pickled change so older files are ignored
+CACHE_MAGIC = b'ENGPYC7'
+
+class ProgramCache:
+	def __init__(self, directory=None, max_bytes=CACHE_MAX_BYTES):
+		self.directory = directory or CACHE_DIR
+		self.max_bytes = max_bytes
+
+	def key(self, file_name, text, opt_level, var_types):
+		# The file name is part of the key since every position in the tree holds it
+		header = repr((__version__, file_name, opt_level, var_types)).encode()
+		digest = hashlib.sha256(header + b'\0')
+		# Bytes are hashed where they are, so a memory mapped file is never copied
+		digest.update(text.encode() if isinstance(text, str) else text)
+		return digest.hexdigest()
+
+	def path(self, key):
+		return os.path.join(self.directory, key + '.engc')
+
+	def load(self, key):
+		path = self.path(key)
+		try:
+			with open(path, 'rb') as file:
+				data = file.read()
+			if not data.startswith(CACHE_MAGIC):
+				return None
+			entry = pickle.loads(zlib.decompress(data[len(CACHE_MAGIC):]))
+			# Loading counts as a use, eviction removes the files which were used least recently
+			os.utime(path)
+		except Exception:
+			# A missing, unreadable or half written entry is just a miss
+			return None
+		return entry
+
+	def store(self, key, entry):
+		try:
+			data = CACHE_MAGIC + zlib.compress(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+		except RecursionError:
+			# Trees nested too deeply for pickle are not cached
+			return
+
+		try:
+			os.makedirs(self.directory, exist_ok=True)
+			# The entry is written to a temporary file and then renamed, so another process never reads half of it
+			fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+			try:
+				with os.fdopen(fd, 'wb') as file:
+					file.write(data)
+				os.replace(temp_path, self.path(key))
+			except OSError:
+				os.remove(temp_path)
+				raise
+		except OSError:
+			return
+		self.evict()
+
+	def evict(self):
+		entries = []
+		for entry in os.scandir(self.directory):
+			if entry.name.endswith('.engc'):
+				try:
+					stat = entry.stat()
+				except OSError:
+					continue
+				entries.append((stat.st_mtime, stat.st_size, entry.path))
 
-	if debug:
-		print('TOKENS:')
-		print(tokens, '\n')
+		total = sum(size for mtime, size, path in entries)
+		for mtime, size, path in sorted(entries):
+			if total <= self.max_bytes:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+
+# Number of parsed programs ParseCache keeps in memory by default
+PARSE_CACHE_SIZE = 128
+
+class ParseCache:
+	def __init__(self, capacity=PARSE_CACHE_SIZE):
+		self.capacity = capacity
+		self.entries = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		# Contexts in different threads share the cache, and moving an entry to the end is not safe to do at the same time
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return entry
+
+	def put(self, key, entry):
+		with self.lock:
+			self.entries[key] = entry
+			self.entries.move_to_end(key)
+			while len(self.entries) > max(self.capacity, 0):
+				self.entries.popitem(last=False)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.hits = 0
+			self.misses = 0
+
+	def __len__(self):
+		return len(self.entries)
 
-	
-	for tok in tokens:
-		parser = Parser(tok)
-		ast = parser.parse()
-		if ast.error: return None, ast.error
-
-		if debug:
-			print('\nAST:')
-			print(ast.node)
-
-		interpreter = Interpreter(debug=debug)
-		result, output = interpreter.visit(ast.node)
-		#print(result.value, result.error)
-		
-		if result == None and output == None:
-			continue
+	def __repr__(self):
+		return f'ParseCache({len(self.entries)}/{self.capacity}, hits:{self.hits}, misses:{self.misses})'
+
+# Shared by every Context. Nothing writes to a tree once it is parsed (the Optimizer makes new nodes and
+# the engines keep their state to themselves), so the same programNode can be run any number of times
+PARSE_CACHE = ParseCache()
+
+def parseText(file_name, text):
+	# Lexes and parses text, returning the same as Parser.parseProgram, a lexer error comes back as an empty program with the error.
+	# Only str text goes in PARSE_CACHE, bytes such as a memory mapped file are parsed every time since keeping them would keep
+	# the file open
+	cached = isinstance(text, str)
+	if cached:
+		entry = PARSE_CACHE.get((file_name, text))
+		if entry is not None: return entry
+
+	stream, error = Lexer(file_name, text).makeTokenStream()
+	if error:
+		entry = programNode([]), error, None
+	else:
+		entry = Parser(stream).parseProgram()
+	if cached:
+		PARSE_CACHE.put((file_name, text), entry)
+	return entry
+
+def loadProgram(file_name, text, opt_level=1, var_types=(), cache=None):
+	# Parses and optimizes text, returning the same as parseText. With a ProgramCache a stored result is used
+	# instead and Lexer and Parser never run
+	if cache:
+		key = cache.key(file_name, text, opt_level, var_types)
+		entry = cache.load(key)
+		if entry: return entry
+
+	program, error, remaining_tokens = parseText(file_name, text)
+	entry = Optimizer(opt_level, program, var_types).optimizeProgram(program), error, remaining_tokens
+
+	if cache:
+		cache.store(key, entry)
+	return entry
+
+################
+# OUTPUT
+################
+
+# How many characters BufferedOutput holds before writing them out
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+class OutputSink:
+	# Where a Context sends the values it outputs. write takes a value and writes it on its own line, flush makes sure
+	# everything written so far has reached its destination. Contexts flush at BREAK, after an error, when a program ends
+	# and after each statement of a streamed program
+	def write(self, value):
+		raise NotImplementedError
+
+	def flush(self):
+		pass
+
+
+class BufferedOutput(OutputSink):
+	# Keeps lines until there are buffer_size characters of them and writes them to file all at once, so a loop which
+	# outputs a lot does one write for many lines instead of one for each. A file of None is sys.stdout at the time of
+	# the write, which lets contextlib.redirect_stdout still catch the output
+	def __init__(self, file=None, buffer_size=OUTPUT_BUFFER_SIZE):
+		self.file = file
+		self.buffer_size = buffer_size
+		self.lines = []
+		self.size = 0
+
+	def write(self, value):
+		line = str(value)
+		self.lines.append(line)
+		self.size += len(line) + 1
+		if self.size >= self.buffer_size:
+			self.flush()
+
+	def flush(self):
+		if not self.lines: return
+		file = sys.stdout if self.file is None else self.file
+		self.lines.append('')
+		text = '\n'.join(self.lines)
+		self.lines = []
+		self.size = 0
+		file.write(text)
+		file.flush()
+
+
+class FileOutput(BufferedOutput):
+	# A BufferedOutput which opens its own file from a file name or a file descriptor, close flushes and closes it
+	# (a file descriptor is left open for whoever gave it)
+	def __init__(self, target, buffer_size=OUTPUT_BUFFER_SIZE, encoding='utf-8'):
+		super().__init__(open(target, 'w', encoding=encoding, closefd=not isinstance(target, int)), buffer_size)
+
+	def close(self):
+		self.flush()
+		self.file.close()
+
+
+class CollectedOutput(OutputSink):
+	# Keeps every line in memory for programs run from inside another program, getvalue returns them as one string
+	def __init__(self):
+		self.lines = []
+
+	def write(self, value):
+		self.lines.append(str(value))
+
+	def getvalue(self):
+		return ''.join(line + '\n' for line in self.lines)
+
+def outputSink(output):
+	# A Context can be given any file object, which is written to through a BufferedOutput
+	if isinstance(output, OutputSink):
+		return output
+	return BufferedOutput(output)
+
+################
+# STREAMING
+################
+
+# The characters which decide where a statement ends, everything else is skipped over
+STATEMENT_CHARS = re.compile(r'["\[\]]')
+
+def splitStatements(lines):
+	# Joins lines (read one at a time, each ending in a new line) into top level statements. A statement ends with the
+	# first line which leaves no '[' or string open, so a FOR loop or an IF with its ELSEIF and ELSE arms is one statement.
+	# Yields the line each statement starts on and its text. Lines are counted from the first one with any text in it,
+	# since runFromFile strips the text of a file before running it
+	buffered = []
+	first_line = 0
+	line_number = None
+	depth = 0
+	in_string = False
+
+	for line in lines:
+		if line_number is None:
+			if not line.strip(): continue
+			line_number = 0
+		else:
+			line_number += 1
+
+		if not buffered:
+			if not line.strip(): continue
+			first_line = line_number
+
+		buffered.append(line)
+		for match in STATEMENT_CHARS.finditer(line):
+			char = match.group()
+			if char == '"':
+				in_string = not in_string
+			elif in_string:
+				pass
+			elif char == '[':
+				depth += 1
+			elif depth:
+				# Like the lexer, a ']' with no block open does not close anything
+				depth -= 1
+
+		if depth == 0 and not in_string:
+			yield first_line, ''.join(buffered)
+			buffered = []
+
+	if buffered:
+		# A block or string left open at the end is closed by the lexer
+		yield first_line, ''.join(buffered)
 
-		res = result.value
-		error = result.error
+################
+# CONTEXT
+################
 
-		if error:
-			if isinstance(error, Error):
-				if file_name != '<shell>':
-					print(error.asString(noArrows=True))
+class Context:
+	# Everything a program runs with: its saved variables, where its output goes (None is sys.stdout at the time it is
+	# printed) and the options for run. Nothing in one Context is seen by another, so each thread can run programs with
+	# its own Context at the same time as the others
+	def __init__(self, engine='tree', debug=False, tiering=True, tier_threshold=None, opt_level=1, cache=None, output=None, variables=None):
+		self.engine = engine
+		self.debug = debug
+		self.tiering = tiering
+		self.tier_threshold = tier_threshold
+		self.opt_level = opt_level
+		self.cache = cache
+		self.output = outputSink(output)
+		self.variables = Variables() if variables is None else variables
+
+	def makeEngine(self, values):
+		# values is the frame of the program the engine runs
+		if self.engine == 'tree':
+			return Interpreter(debug=self.debug, tiering=self.tiering, tier_threshold=self.tier_threshold, context=self, values=values)
+		return ENGINES[self.engine](debug=self.debug, context=self, values=values)
+
+	def run(self, file_name, text):
+		# Anything still in the output buffer is written when the program ends, even if it ended with an exception
+		try:
+			stopped, error = self.runProgram(file_name, text)
+		finally:
+			self.output.flush()
+		return None, error
+
+	def runStream(self, file_name, lines):
+		# Runs a program while its lines are still being read from lines (any iterable of strings, such as an open file),
+		# see splitStatements
+		try:
+			stopped, error = self.runStatements(file_name, lines)
+		finally:
+			self.output.flush()
+		return None, error
+
+	def runProgram(self, file_name, text):
+		# Returns whether the program stopped early because of an error, and the error if it was not reported already
+		engine, opt_level = self.engine, self.opt_level
+		if engine not in ENGINES:
+			return True, f"Unknown engine '{engine}', expected one of: {', '.join(ENGINES)}"
+
+		if self.debug:
+			return self.runDebug(Lexer(file_name, text), opt_level)
+
+		var_types = savedVarTypes(self.variables) if opt_level >= 1 else ()
+		if engine in COMPILERS and isinstance(text, str):
+			# Compiled programs are cached, so running the same text again skips straight to the compiled code.
+			# The types of the saved variables are part of the key since the type specialised nodes depend on them
+			return compileProgram(file_name, text, engine, opt_level, var_types, self.cache).runStatements(self)
+		if engine in COMPILERS:
+			# Like PARSE_CACHE, compileProgram's cache would keep bytes text alive
+			program, error, remaining_tokens = loadProgram(file_name, text, opt_level, var_types, self.cache)
+			return compileParsed(file_name, engine, program, error, remaining_tokens).runStatements(self)
+
+		program, error, remaining_tokens = loadProgram(file_name, text, opt_level, var_types, self.cache)
+		return self.runParsed(file_name, program, error, remaining_tokens)
+
+	def runStatements(self, file_name, lines):
+		# Each statement is lexed, parsed and run before the next one is read, so only one statement is ever held in memory.
+		# Statements are optimized on their own like shell lines, so assignments are never removed as dead
+		engine, opt_level = self.engine, min(self.opt_level, 1)
+		if engine not in ENGINES:
+			return True, f"Unknown engine '{engine}', expected one of: {', '.join(ENGINES)}"
+
+		found_text = False
+		for first_line, text in splitStatements(lines):
+			found_text = True
+			lexer = Lexer(file_name, text, first_line)
+			if self.debug:
+				stopped, error = self.runDebug(lexer, opt_level)
+			else:
+				stream, error = lexer.makeTokenStream()
+				if error: return True, error
+
+				program, error, remaining_tokens = Parser(stream).parseProgram()
+				var_types = savedVarTypes(self.variables) if opt_level >= 1 else ()
+				program = Optimizer(opt_level, program, var_types).optimizeProgram(program)
+				if engine in COMPILERS:
+					stopped, error = compileParsed(file_name, engine, program, error, remaining_tokens).runStatements(self)
 				else:
-					print(error.asString())
+					stopped, error = self.runParsed(file_name, program, error, remaining_tokens)
+			# The next statement may not have been written yet, so what this one output is shown now instead of at the end
+			self.output.flush()
+			if stopped: return stopped, error
+
+		if not found_text:
+			# Gives the same error as lexing an empty file
+			return True, Lexer(file_name, '').makeTokenStream()[1]
+		return False, None
+
+	def runDebug(self, lexer, opt_level):
+		# Debug mode always lexes and parses so the tokens and both versions of the AST can be shown
+		stream, error = lexer.makeTokenStream()
+		if error: return True, error
+
+		self.output.write('TOKENS:')
+		self.output.write(f'{stream.toLines()} \n')
+
+		program, error, remaining_tokens = Parser(stream).parseProgram()
+		optimizer = Optimizer(opt_level, program, savedVarTypes(self.variables))
+		return self.runParsed(lexer.fn, program, error, remaining_tokens, optimizer)
+
+	def runParsed(self, file_name, program, error, remaining_tokens, optimizer=None):
+		values = self.variables.frame(program.names)
+		try:
+			return self.runFrame(file_name, program, error, remaining_tokens, optimizer, values)
+		finally:
+			self.variables.store(program.names, values)
+
+	def runFrame(self, file_name, program, error, remaining_tokens, optimizer, values):
+		# Runs the statements of a parsed program one at a time. In debug mode the optimizer is given and each statement
+		# is shown before and after it is optimized
+		debug, output = self.debug, self.output
+		interpreter = self.makeEngine(values)
+
+		for node in program:
+			if optimizer:
+				output.write('\nAST:')
+				output.write(node)
+
+				node = optimizer.optimizeStatement(node)
+				if node is None: continue
+
+				if optimizer.level > 0:
+					output.write('\nOPTIMIZED AST:')
+					output.write(node)
+
+			result, result_output = interpreter.execute(node)
+			#print(result.value, result.error)
+			
+			if reportResult(file_name, result, result_output, debug, output): return True, None
+
+		if error: return True, error
+		if remaining_tokens:
+			# Let the line the parser could not handle fail now that the lines before it have run
+			stream, idx = remaining_tokens
+			ast = Parser(stream).parseLine(idx)
+			if ast.error: return True, ast.error
+		
+		return False, None
+
+# Used by run when it is not given a Context, and by the engines when they are made without one. Its variables are
+# VARS_SAVED, which is how the shell keeps variables from one line to the next
+DEFAULT_CONTEXT = Context(variables=VARS_SAVED)
+
+################
+# FUNCTIONS
+################
+
+ENGINES = {
+	'tree': Interpreter,
+	'vm': VirtualMachine,
+	'closure': ClosureCompiler,
+	'python': PythonTranspiler,
+}
+
+def reportResult(file_name, result, output, debug=False, sink=None):
+	# Writes the outcome of a top level statement to sink, returns True if it was an error and the program should stop
+	if result == None and output == None:
+		return False
+
+	res = result.value
+	error = result.error
+	if sink is None:
+		sink = DEFAULT_CONTEXT.output
+
+	if error:
+		if isinstance(error, Error):
+			if file_name != '<shell>':
+				sink.write(error.asString(noArrows=True))
 			else:
-				print(error)
-			return None, None
+				sink.write(error.asString())
 		else:
-			if output or debug:
-				if res is not None:
-					print(res)
-	
-	return None, None
\ No newline at end of file
+			sink.write(error)
+		sink.flush()
+		return True
+	else:
+		if output or debug:
+			if res is not None:
+				sink.write(res)
+	return False
+
+# The characters bytes.strip removes
+WHITESPACE_BYTES = b' \t\n\r\x0b\x0c'
+
+@contextlib.contextmanager
+def openSource(file_name):
+	# Memory maps a file and gives back its text as a memoryview of the bytes with the whitespace at both ends left out, so
+	# the text is never read into a str. The file is closed when the with block ends, so anything which points into it
+	# (such as the Positions of an Error) has to be used before then
+	with open(file_name, 'rb') as file:
+		if os.fstat(file.fileno()).st_size == 0:
+			# An empty file can not be mapped
+			yield b''
+			return
+
+		with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+			start = 0
+			end = len(mapped)
+			while start < end and mapped[start] in WHITESPACE_BYTES:
+				start += 1
+			while end > start and mapped[end - 1] in WHITESPACE_BYTES:
+				end -= 1
+			with view[start:end] as text:
+				yield text
+
+def run(file_name, text, debug=False, engine='tree', tiering=True, tier_threshold=None, opt_level=1, cache=None, context=None):
+	# Without a context the program runs with the options given here and the variables in VARS_SAVED
+	if context is None:
+		context = Context(engine, debug, tiering, tier_threshold, opt_level, cache, variables=VARS_SAVED)
+	return context.run(file_name, text)
+
+def runStream(file_name, lines, debug=False, engine='tree', tiering=True, tier_threshold=None, opt_level=1, context=None):
+	# Like run, but each statement is run as soon as it has been read from lines
+	if context is None:
+		context = Context(engine, debug, tiering, tier_threshold, opt_level, variables=VARS_SAVED)
+	return context.runStream(file_name, lines)
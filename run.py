@@ -1,13 +1,15 @@
 import sys
 
-from engpy import run, Error
+from engpy import run, runStream, compileProgram, openSource, Error, ProgramCache
 
-def runFromShell(debug=False):
+def runFromShell(debug=False, **options):
+	# Every line is its own program in the shell, so an assignment is never dead just because that line does not read it
+	options['opt_level'] = min(options.get('opt_level', 1), 1)
 	while True:
 		input_text = input('engpy > ')
 		if not input_text:
 			continue
-		result, error = run('<shell>', input_text + '\n', debug=debug)
+		result, error = run('<shell>', input_text + '\n', debug=debug, **options)
 
 		if error:
 			if isinstance(error, Error):
@@ -17,9 +19,27 @@ def runFromShell(debug=False):
 		else:
 			if result is not None:
 				print(result)
- 
-def runFromFile(file_name, debug=False):
-	result, error = run(file_name, open(file_name, 'r').read().strip(), debug=debug)
+
+def runFromFile(file_name, debug=False, **options):
+	# The file is memory mapped and lexed as bytes, the error is printed before the file is closed since it points into it
+	with openSource(file_name) as text:
+		result, error = run(file_name, text, debug=debug, **options)
+		if error:
+			if isinstance(error, Error):
+				print(error.asString(noArrows=True))
+			else:
+				print(error)
+		else:
+			if result is not None:
+				print(result)
+
+def runFromStream(file_name, debug=False, **options):
+	# Every statement runs as soon as it has been read, '-' reads from stdin
+	if file_name == '-':
+		result, error = runStream('<stdin>', sys.stdin, debug=debug, **options)
+	else:
+		with open(file_name, 'r') as file:
+			result, error = runStream(file_name, file, debug=debug, **options)
 	if error:
 		if isinstance(error, Error):
 			print(error.asString(noArrows=True))
@@ -29,25 +49,59 @@ def runFromFile(file_name, debug=False):
 		if result is not None:
 			print(result)
 
+def emitPythonFromFile(file_name, opt_level=1):
+	program = compileProgram(file_name, open(file_name, 'r').read().strip(), 'python', opt_level)
+	print(program.source, end='')
+	if program.error:
+		print(program.error.asString(noArrows=True))
+
+def parseArgs(argv):
+	target = None
+	options = {'debug': False, 'engine': 'tree'}
+	for arg in argv:
+		if arg == '-d':
+			options['debug'] = True
+		elif arg == '--emit-python':
+			options['emit_python'] = True
+		elif arg.startswith('--engine='):
+			options['engine'] = arg.split('=', 1)[1]
+		elif arg in ['-O0', '-O1', '-O2']:
+			options['opt_level'] = int(arg[2])
+		elif arg == '--stream':
+			options['stream'] = True
+		elif arg == '--no-cache':
+			options['no_cache'] = True
+		elif arg.startswith('--cache-dir='):
+			options['cache_dir'] = arg.split('=', 1)[1]
+		elif arg == '--no-tiering':
+			options['tiering'] = False
+		elif arg.startswith('--tier-threshold='):
+			options['tier_threshold'] = int(arg.split('=', 1)[1])
+		elif target is None:
+			target = arg
+		else:
+			print(f'Unexpected argument: {arg}')
+			sys.exit(1)
+	return target, options
+
 
 
 if __name__ == '__main__':
 	# try:
-		if len(sys.argv) > 1:
-			if sys.argv[1] == 'shell':
-				if len(sys.argv) > 2:
-					if sys.argv[2] == '-d':
-						runFromShell(debug=True)
-				else:
-					runFromShell()
-			else:
-				if len(sys.argv) > 2:
-					if sys.argv[2] == '-d':
-						runFromFile(sys.argv[1], debug=True)
-				else:
-					runFromFile(sys.argv[1])
+		target, options = parseArgs(sys.argv[1:])
+		no_cache = options.pop('no_cache', False)
+		cache_dir = options.pop('cache_dir', None)
+		stream = options.pop('stream', False)
+		if options.pop('emit_python', False):
+			emitPythonFromFile(target, options.get('opt_level', 1))
+		elif target is None or target == 'shell':
+			runFromShell(**options)
+		elif target == '-' or stream:
+			# Streamed programs are never cached since they are only read once
+			runFromStream(target, **options)
 		else:
-			runFromShell()
+			# Files keep their parsed program on disk, so running one again skips lexing and parsing
+			runFromFile(target, cache=None if no_cache else ProgramCache(cache_dir), **options)
 	# except Exception as e:
 	# 	print(e)
-	# 	print('Something went wrong, quitting.')
\ No newline at end of file
+	# 	print('Something went wrong, quitting.')